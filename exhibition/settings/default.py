@@ -105,6 +105,36 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+    },
+    # Point-in-time copy of the database that exports may read from (see EXPORT_FROM_SNAPSHOT)
+    'snapshot': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'exports', 'snapshot.sqlite3'),
+    }
+}
+
+DATABASE_ROUTERS = ['registrations.snapshot.SnapshotRouter']
+
+# Pragmas set on every new SQLite connection. WAL lets readers go on while a
+# registration is being written, and writers wait (in milliseconds) for each
+# other instead of failing with "database is locked". Set to {} to keep the
+# SQLite defaults.
+
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 20000,
+    'cache_size': -64000,
+    'mmap_size': 268435456,
+}
+
+
+# Cache shared by all processes (used for the commissioner email routing)
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(BASE_DIR, 'cache'),
     }
 }
 
@@ -153,6 +183,50 @@ STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are served by Django only to their owners and staff. Once access is checked, the
+# transfer can be handed to the web server: 'X-Sendfile' for Apache with mod_xsendfile, or
+# 'X-Accel-Redirect' for nginx, with an internal location that maps the prefix to MEDIA_ROOT.
+# Leave empty to have Django send the files itself (fine for development).
+
+MEDIA_SENDFILE = ''
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
+
+# Exports prepared in the background (not publicly served), how many days to keep them, and
+# after how many seconds a job still running is taken to have been left by a worker that died
+
+EXPORT_ROOT = os.path.join(BASE_DIR, 'exports')
+EXPORT_JOB_RETENTION_DAYS = 7
+EXPORT_JOB_TIMEOUT = 60 * 60
+
+
+# Have exports read from a snapshot of the database, so that they do not hold the live one while
+# registrations are written and all sheets of an export see the same data. The snapshot is
+# taken with the snapshot_database command, or by the export worker when older than the interval
+# (in seconds).
+
+EXPORT_FROM_SNAPSHOT = False
+EXPORT_SNAPSHOT_INTERVAL = 10 * 60
+
+
+# Have the export worker keep static copies of the public exhibit listings (per class, per
+# class with jury groups, per country) in this directory, for the web server to send directly.
+# Changes are published once exhibits stop changing for a while (in seconds), but no later
+# than the maximum delay after the previous publication. The publish_catalogue command
+# publishes immediately.
+
+PUBLISH_CATALOGUE = False
+CATALOGUE_ROOT = os.path.join(BASE_DIR, 'catalogue')
+CATALOGUE_DEBOUNCE = 60
+CATALOGUE_MAX_DELAY = 10 * 60
+
+
+# Have the export worker delete exhibit files no exhibit refers to (such as uploads of forms that
+# were never saved) every this many seconds. Files stored or reused within the last ten minutes
+# are kept. Set to 0 to only delete them with the collect_exhibit_files command.
+
+EXHIBIT_FILES_COLLECT_INTERVAL = 60 * 60
+
 
 # Authentication with OAuth 2
 
@@ -246,3 +320,16 @@ EMAIL_ADDITIONAL_RECIPIENTS = []
 # Send all emails only to the additional recipients list
 
 EMAIL_ONLY_ADDITIONAL_RECIPIENTS = False
+
+
+# Collect the exhibit registrations of each commissioner and email them together,
+# at most once every this many seconds (0 emails every submission separately)
+
+COMMISSIONER_DIGEST_INTERVAL = 0
+
+
+# Emails are queued and sent by the email_dispatcher command. Failed emails are
+# retried after this many seconds, doubling the delay on every attempt.
+
+EMAIL_RETRY_DELAY = 60
+EMAIL_MAX_ATTEMPTS = 6
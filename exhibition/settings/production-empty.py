@@ -38,6 +38,12 @@ CSRF_COOKIE_SECURE = True
 SESSION_COOKIE_SECURE = True
 SECURE_PROXY_SSL_HEADER = ('HTTP_X_FORWARDED_PROTO', 'https')
 
+# Have Apache send uploads once access is checked (needs mod_xsendfile)
+MEDIA_SENDFILE = 'X-Sendfile'
+
+# Keep static copies of the public exhibit listings in the catalogue directory
+PUBLISH_CATALOGUE = True
+
 # Settings for sending emails
 EMAIL_HOST = 'mail.hps.gr'
 EMAIL_PORT = 465
@@ -84,6 +90,11 @@ ENTRY_FORMS_SUBMIT_MESSAGE = 'By submitting this Entry Form the Exhibitor accept
 # If we have no commissioner contact, we email to this address (if it exists).
 NO_COMMISSIONER_EMAIL = ''
 
+# Collect the exhibit registrations of each commissioner and email them
+# together, at most once every this many seconds (0 emails every submission
+# separately).
+COMMISSIONER_DIGEST_INTERVAL = 0
+
 # We note to emails sent to commissioners that any objections should
 # be directed to this email.
 GENERAL_COMMISSIONER_EMAIL = ''
@@ -17,12 +17,13 @@
 from django.contrib import admin
 from django.contrib.auth.models import User
 from django.contrib.auth.admin import UserAdmin
-from django.shortcuts import redirect, reverse
-from django.utils.http import urlencode
+from django.shortcuts import redirect
+from django.utils.html import format_html
+from django.conf import settings
 from admin_views.admin import AdminViews
 from impersonate.admin import UserAdminImpersonateMixin
 
-from .models import Participant, Federation, Appointments, Exhibit, ExhibitParticipation, TravelDetails
+from .models import Participant, Federation, Appointments, Exhibit, ExhibitParticipation, TravelDetails, ExportJob, OutgoingEmail
 
 
 class NewUserAdmin(UserAdminImpersonateMixin, UserAdmin):
@@ -34,7 +35,8 @@ admin.site.register(User, NewUserAdmin)
 
 @admin.register(Participant)
 class ParticipantAdmin(AdminViews):
-    list_display = ('full_name', 'country', 'telephone', 'mobile', 'language', 'changed_at')
+    list_display = ('photo_thumbnail', 'full_name', 'country', 'telephone', 'mobile', 'language', 'changed_at')
+    list_display_links = ('photo_thumbnail', 'full_name')
     admin_views = (('Export to CSV', 'export_to_csv'),
                    ('Export to XLSX', 'export_to_xlsx'),
                    ('Download XLSX report', 'report_to_xlsx'),
@@ -42,32 +44,53 @@ class ParticipantAdmin(AdminViews):
                    ('Download exhibits in HTML (per class)', 'exhibits_in_html_per_class'),
                    ('Download exhibits in HTML (per class, plus jury groups)', 'exhibits_in_html_per_class_plus_jury_groups'),
                    ('Download exhibits in HTML (per class, plus jury groups and intro/synopsis)', 'exhibits_in_html_per_class_plus_intro'),
-                   ('Download exhibits in HTML (per country)', 'exhibits_in_html_per_country'))
+                   ('Download exhibits in HTML (per country)', 'exhibits_in_html_per_country'),
+                   ('Download intro/synopsis files for the jury', 'jury_media'),
+                   ('Export jobs', 'export_jobs'))
     readonly_fields = ('created_at', 'changed_at')
 
-    def export_to_csv(self, *args, **kwargs):
-        return redirect('{}?{}'.format(reverse('export_raw'), urlencode({'type': 'csv'})))
+    def photo_thumbnail(self, obj):
+        if not obj.photo:
+            return ''
+        return format_html('<img src="{}" alt="">', obj.photo_thumbnail_url('small'))
+    photo_thumbnail.short_description = 'Photo'
 
-    def export_to_xlsx(self, *args, **kwargs):
-        return redirect('{}?{}'.format(reverse('export_raw'), urlencode({'type': 'xlsx'})))
+    # Exports run in the export_worker process, so that they do not occupy the web workers
+    def queue_export(self, request, kind):
+        ExportJob.objects.create(kind=kind,
+                                 requested_by=request.user,
+                                 media_url=request.build_absolute_uri(settings.MEDIA_URL))
+        return redirect('export_jobs')
 
-    def report_to_xlsx(self, *args, **kwargs):
-        return redirect('export_report')
+    def export_to_csv(self, request, *args, **kwargs):
+        return self.queue_export(request, 'RAW_CSV')
 
-    def report_to_xlsx_inventory(self, *args, **kwargs):
-        return redirect('{}?{}'.format(reverse('export_report'), urlencode({'type': 'inventory'})))
+    def export_to_xlsx(self, request, *args, **kwargs):
+        return self.queue_export(request, 'RAW_XLSX')
 
-    def exhibits_in_html_per_class(self, *args, **kwargs):
-        return redirect('{}?{}'.format(reverse('export_exhibits'), urlencode({'sort': 'class'})))
+    def report_to_xlsx(self, request, *args, **kwargs):
+        return self.queue_export(request, 'REPORT')
 
-    def exhibits_in_html_per_class_plus_jury_groups(self, *args, **kwargs):
-        return redirect('{}?{}'.format(reverse('export_exhibits'), urlencode({'sort': 'class', 'extras': '1'})))
+    def report_to_xlsx_inventory(self, request, *args, **kwargs):
+        return self.queue_export(request, 'REPORT_INVENTORY')
 
-    def exhibits_in_html_per_class_plus_intro(self, *args, **kwargs):
-        return redirect('{}?{}'.format(reverse('export_exhibits'), urlencode({'sort': 'class', 'extras': '2'})))
+    def exhibits_in_html_per_class(self, request, *args, **kwargs):
+        return self.queue_export(request, 'EXHIBITS_CLASS')
 
-    def exhibits_in_html_per_country(self, *args, **kwargs):
-        return redirect('{}?{}'.format(reverse('export_exhibits'), urlencode({'sort': 'country'})))
+    def exhibits_in_html_per_class_plus_jury_groups(self, request, *args, **kwargs):
+        return self.queue_export(request, 'EXHIBITS_JURY')
+
+    def exhibits_in_html_per_class_plus_intro(self, request, *args, **kwargs):
+        return self.queue_export(request, 'EXHIBITS_INTRO')
+
+    def exhibits_in_html_per_country(self, request, *args, **kwargs):
+        return self.queue_export(request, 'EXHIBITS_COUNTRY')
+
+    def jury_media(self, *args, **kwargs):
+        return redirect('export_jury_media')
+
+    def export_jobs(self, *args, **kwargs):
+        return redirect('export_jobs')
 
 @admin.register(Federation)
 class FederationAdmin(admin.ModelAdmin):
@@ -120,3 +143,16 @@ class ExhibitAdmin(admin.ModelAdmin):
 class TravelDetailsAdmin(admin.ModelAdmin):
     list_display = ('participant', 'arrival', 'arrival_flight_number', 'departure', 'departure_flight_number', 'changed_at')
     readonly_fields = ('created_at', 'changed_at')
+
+@admin.register(ExportJob)
+class ExportJobAdmin(admin.ModelAdmin):
+    list_display = ('kind', 'status', 'progress', 'requested_by', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = ('created_at', 'started_at', 'finished_at')
+
+@admin.register(OutgoingEmail)
+class OutgoingEmailAdmin(admin.ModelAdmin):
+    list_display = ('subject', 'recipients', 'status', 'attempts', 'created_at', 'sent_at')
+    list_filter = ('status',)
+    search_fields = ('subject', 'recipients')
+    readonly_fields = ('created_at', 'sent_at')
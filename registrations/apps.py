@@ -19,3 +19,6 @@ from django.apps import AppConfig
 
 class RegistrationsConfig(AppConfig):
     name = 'registrations'
+
+    def ready(self):
+        from . import signals
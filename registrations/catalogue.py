@@ -0,0 +1,89 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import time
+import tempfile
+
+from django.conf import settings
+from django.utils import timezone
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+from .models import Exhibit
+from .export import render_exhibits
+
+
+# Public exhibit listings written to CATALOGUE_ROOT: file -> (sort, extras)
+CATALOGUE_FILES = OrderedDict([('exhibits-class.html', ('class', 0)),
+                               ('exhibits-jury.html', ('class', 1)),
+                               ('exhibits-country.html', ('country', 0))])
+
+# Listing state the files were rendered from
+CATALOGUE_STATE_FILE = '.state'
+
+def catalogue_state():
+    return repr(sorted(Exhibit.listing_state().items()))
+
+def published_state():
+    try:
+        with open(os.path.join(settings.CATALOGUE_ROOT, CATALOGUE_STATE_FILE)) as stream:
+            return stream.read()
+    except OSError:
+        return None
+
+def write_catalogue_file(name, content):
+    # Replace each file as a whole, so that the web server never sends a partial one
+    descriptor, temporary_path = tempfile.mkstemp(dir=settings.CATALOGUE_ROOT, prefix='.%s-' % name)
+    try:
+        with os.fdopen(descriptor, 'w', encoding='utf-8') as stream:
+            stream.write(content)
+        # mkstemp() creates the file readable only by its owner
+        os.chmod(temporary_path, 0o644)
+        os.replace(temporary_path, os.path.join(settings.CATALOGUE_ROOT, name))
+    except Exception:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        raise
+
+def publish_catalogue(state=None):
+    # The state is read before rendering, so changes made meanwhile are published next time
+    state = state or catalogue_state()
+    os.makedirs(settings.CATALOGUE_ROOT, exist_ok=True)
+    for name, (export_sort, extras) in CATALOGUE_FILES.items():
+        write_catalogue_file(name, render_exhibits(export_sort, extras))
+    write_catalogue_file(CATALOGUE_STATE_FILE, state)
+
+def publish_changed_catalogue():
+    # Called repeatedly by the export worker. Changes are coalesced: the catalogue is published
+    # once no exhibit or participant has changed for CATALOGUE_DEBOUNCE seconds, or at the
+    # latest CATALOGUE_MAX_DELAY seconds after the previous publication, if changes keep coming.
+    listing_state = Exhibit.listing_state()
+    state = repr(sorted(listing_state.items()))
+    if state == published_state():
+        return False
+
+    changes = [value for value in listing_state.values() if isinstance(value, datetime)]
+    if changes and max(changes) > timezone.now() - timedelta(seconds=settings.CATALOGUE_DEBOUNCE):
+        try:
+            published_at = os.path.getmtime(os.path.join(settings.CATALOGUE_ROOT, CATALOGUE_STATE_FILE))
+        except OSError:
+            published_at = 0
+        if published_at > time.time() - settings.CATALOGUE_MAX_DELAY:
+            return False
+
+    publish_catalogue(state)
+    return True
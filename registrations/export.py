@@ -0,0 +1,511 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import io
+import re
+import csv
+import time
+import django
+import zipfile
+import hashlib
+import tempfile
+import traceback
+import xlsxwriter
+
+from django.conf import settings
+from django.apps import apps
+from django.db import connections, router
+from django.db.models import Prefetch
+from django.http import FileResponse
+from django.core.files import File
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+from datetime import datetime, timedelta
+from collections import OrderedDict
+
+from .snapshot import export_snapshot
+from .models import country_names, ExportMixin, Participant, Federation, Appointments, Exhibit, DeletedExhibit, ExhibitParticipation, TravelDetails, ExportJob
+
+
+# Bytes collected before handing a piece of the archive to the response
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Workbooks are kept in memory up to this size, then spooled to disk
+XLSX_SPOOL_SIZE = 8 * 1024 * 1024
+
+# Rows are flushed to disk as soon as the next one is started,
+# so every worksheet must be written strictly row by row
+XLSX_OPTIONS = {'constant_memory': True,
+                'strings_to_numbers': False,
+                'strings_to_formulas': False,
+                'strings_to_urls': False}
+
+
+def data_version():
+    # Fingerprint of all exported data in a single query: the newest change
+    # per table (served by the changed_at indexes) plus row counts for deletions
+    connection = connections[router.db_for_read(Participant)]
+    selects = []
+    for model, timestamp in ((Participant, 'changed_at'),
+                             (Federation, 'changed_at'),
+                             (Appointments, 'changed_at'),
+                             (Exhibit, 'changed_at'),
+                             (DeletedExhibit, 'deleted_at'),
+                             (ExhibitParticipation, 'changed_at'),
+                             (TravelDetails, 'changed_at')):
+        table = connection.ops.quote_name(model._meta.db_table)
+        selects.append('(SELECT MAX(%s) FROM %s)' % (connection.ops.quote_name(timestamp), table))
+        selects.append('(SELECT COUNT(*) FROM %s)' % table)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT %s' % ', '.join(selects))
+        row = cursor.fetchone()
+    return hashlib.sha1(repr(row).encode('utf-8')).hexdigest()
+
+class ExportCache():
+    # Generated artifacts, reused for as long as the data version stays the same
+
+    def __init__(self, variant, extension, version=None):
+        self.variant = variant
+        self.extension = extension
+        self.directory = os.path.join(settings.EXPORT_ROOT, 'cache')
+        self.path = os.path.join(self.directory, '%s-%s.%s' % (variant, version or data_version(), extension))
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def temporary_file(self):
+        os.makedirs(self.directory, exist_ok=True)
+        return tempfile.NamedTemporaryFile(dir=self.directory, prefix='.%s-' % self.variant, delete=False)
+
+    def commit(self, temporary_file):
+        temporary_file.close()
+        os.replace(temporary_file.name, self.path)
+        # Artifacts of older versions will never be served again
+        pattern = re.compile(r'%s-[0-9a-f]{40}\.%s' % (re.escape(self.variant), re.escape(self.extension)))
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if pattern.fullmatch(name) and path != self.path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def discard(self, temporary_file):
+        temporary_file.close()
+        os.remove(temporary_file.name)
+
+    def write(self, write):
+        temporary_file = self.temporary_file()
+        try:
+            write(temporary_file)
+        except:
+            self.discard(temporary_file)
+            raise
+        self.commit(temporary_file)
+
+    def tee(self, chunks):
+        # Pass chunks through to a streaming response, keeping a copy if it completes
+        temporary_file = self.temporary_file()
+        try:
+            for data in chunks:
+                temporary_file.write(data)
+                yield data
+        except:
+            self.discard(temporary_file)
+            raise
+        self.commit(temporary_file)
+
+class ZipStream():
+    # Write-only, non-seekable file object that zipfile writes into. Whatever
+    # has been written since the last call is handed out by pop().
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._position = 0
+
+    def write(self, data):
+        self._buffer.extend(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def pending(self):
+        return len(self._buffer)
+
+    def pop(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+def export_name(kind):
+    return '%s-%s-%s' % (settings.EXHIBITION_NAME.replace(' ', '-'), kind, datetime.now().strftime('%Y%m%d%H%M%S'))
+
+def stream_csv_zip(members, progress=None):
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+        for index, (name, rows) in enumerate(members):
+            with zip_file.open(name, mode='w') as member:
+                text = io.TextIOWrapper(member, encoding='utf-8', newline='')
+                writer = csv.writer(text)
+                for values in rows:
+                    writer.writerow(values)
+                    if stream.pending() >= STREAM_CHUNK_SIZE:
+                        yield stream.pop()
+                text.flush()
+                text.detach()
+            yield stream.pop()
+            if progress:
+                progress((index + 1) / len(members))
+    yield stream.pop()
+
+def raw_tables(since=None):
+    # Rows are generators, so nothing is queried until each table is written
+    tables = [('registrants', Participant.export_rows(since)),
+              ('exhibits', Exhibit.export_rows(since)),
+              ('exhibit_participations', ExhibitParticipation.export_rows(since)),
+              ('federations', Federation.export_rows(since)),
+              ('countries', Participant.export_countries_rows()),
+              ('titles', Participant.export_choices_rows(Participant.TITLE_CHOICES)),
+              ('languages', Participant.export_choices_rows(Participant.LANGUAGE_CHOICES)),
+              ('accredited_jurors', Appointments.export_choices_rows(Appointments.ACCREDITED_JUROR_CHOICES)),
+              ('exhibit_classes', Exhibit.export_choices_rows(Exhibit.EXHIBIT_CLASS_CHOICES)),
+              ('exhibition_levels', ExhibitParticipation.export_choices_rows(ExhibitParticipation.EXHIBITION_LEVEL_CHOICES)),
+              ('medals', ExhibitParticipation.export_choices_rows(ExhibitParticipation.MEDAL_CHOICES))]
+    if since is not None:
+        tables.insert(3, ('deleted_exhibits', DeletedExhibit.export_rows(since)))
+    return tables
+
+def raw_csv_directory():
+    # Directory of the tables in the CSV bundle. It carries no date, as the bundle may be
+    # served from the cache long after it was written (the download name is dated instead).
+    return '%s-export' % settings.EXHIBITION_NAME.replace(' ', '-')
+
+def raw_csv_members(since=None):
+    return [('%s/%s.csv' % (raw_csv_directory(), table), rows) for table, rows in raw_tables(since)]
+
+def write_raw_xlsx(workbook, since=None, progress=None):
+    tables = raw_tables(since)
+    for index, (table, rows) in enumerate(tables):
+        ExportMixin.rows_to_xlsx(workbook, table, rows)
+        if progress:
+            progress((index + 1) / len(tables))
+
+def write_entries(worksheet, entries):
+    if not entries:
+        return
+
+    # Place the sections side by side, each starting after the columns of the previous one
+    # (as found in the first non-empty entry), then write the sheet out row by row
+    layout = []
+    next_column = 0
+    for section in entries[0].keys():
+        column = next_column
+        next_column = 0
+        for entry in [e[section] for e in entries]:
+            if entry:
+                layout.append((section, column))
+                worksheet.write_row(0, column, entry.keys())
+                next_column = column + len(entry)
+                break
+
+    for row, entry in enumerate(entries, 1):
+        for section, column in layout:
+            if not entry[section]:
+                continue
+            worksheet.write_row(row, column, ['\n'.join(str(v).splitlines()) for v in entry[section].values()])
+
+def report_participant_entries():
+    # Related rows are prefetched in pk order, so that the first one matches .first()
+    participants = Participant.objects.prefetch_related(Prefetch('appointments', queryset=Appointments.objects.select_related('federation').order_by('pk')),
+                                                        Prefetch('travel_details', queryset=TravelDetails.objects.order_by('pk')))
+    entries = []
+    for participant in participants:
+        appointments = participant.appointments.all()
+        travel_details = participant.travel_details.all()
+        entries.append({'id': {'ID': participant.id},
+                        'participant': participant.printout(all_fields=True),
+                        'appointments': appointments[0].printout(all_fields=True) if appointments else None,
+                        'travel_details': travel_details[0].printout(all_fields=True) if travel_details else None})
+    return entries
+
+def report_exhibit_entries(report_type=''):
+    if report_type != 'inventory':
+        all_exhibits = Exhibit.objects.all()
+    else:
+        all_exhibits = Exhibit.objects.filter(rejected=False).exclude(exhibit_class__startswith='L')
+    entries = []
+    for exhibit in all_exhibits.select_related('participant'):
+        entries.append({'id': {'ID': exhibit.id},
+                        'exhibit': exhibit.printout(all_fields=True),
+                        'participant': exhibit.participant.printout(all_fields=True)})
+    return entries
+
+def write_report_xlsx(workbook, report_type='', progress=None):
+    if report_type != 'inventory':
+        worksheet = workbook.add_worksheet('Registrants')
+        write_entries(worksheet, report_participant_entries())
+        if progress:
+            progress(0.5)
+
+    worksheet = workbook.add_worksheet('Exhibits')
+    write_entries(worksheet, report_exhibit_entries(report_type))
+    if progress:
+        progress(1)
+
+def write_xlsx(stream, write):
+    with xlsxwriter.Workbook(stream, XLSX_OPTIONS) as workbook:
+        write(workbook)
+
+def xlsx_response(write, filename):
+    stream = tempfile.SpooledTemporaryFile(max_size=XLSX_SPOOL_SIZE)
+    write_xlsx(stream, write)
+    stream.seek(0)
+    return FileResponse(stream, as_attachment=True, filename=filename, content_type='application/xlsx')
+
+def exhibit_sections(export_sort='class', extras=0):
+    # XXX Create some new model for these...
+    JURY_GROUP_NAMES = {'C1': {1: 'Europe North, West, Rest of the World',
+                               2: 'Europe South, East, Mediterranean Sea'},
+                        'C2': {1: 'Europe North, West, Rest of the World',
+                               2: 'Europe South, East, Mediterranean Sea'},
+                        'C7': {1: 'History, Sports',
+                               2: 'Culture, Science, Nature, Transportation'}}
+
+    if export_sort == 'class':
+        sections = OrderedDict({'non-competitive': {'title': 'Non-Competitive Classes',
+                                                    'classes': []},
+                                'competitive': {'title': 'Competitive Classes',
+                                                'classes': []}})
+        class_exhibits = {}
+        for exhibit in Exhibit.objects.filter(rejected=False).select_related('participant').order_by('start_frame', 'participant__surname', 'pk'):
+            class_exhibits.setdefault(exhibit.exhibit_class, []).append(exhibit)
+
+        for exhibit_class, exhibit_class_title in Exhibit.EXHIBIT_CLASS_CHOICES:
+            section = 'non-competitive' if exhibit_class_title.startswith('A') else 'competitive'
+            exhibits = class_exhibits.get(exhibit_class)
+            if not exhibits:
+                continue
+            if extras:
+                jury_groups = set([exhibit.jury_group for exhibit in exhibits])
+                if len(jury_groups) > 1:
+                    for jury_group in sorted([(j if j else 0) for j in jury_groups]):
+                        if jury_group:
+                            try:
+                                jury_group_title_suffix = ' (%s)' % JURY_GROUP_NAMES[exhibit_class][jury_group]
+                            except KeyError:
+                                jury_group_title_suffix = ' (jury group %d)' % jury_group
+                        else:
+                            jury_group_title_suffix = ' (empty jury group)'
+                        sections[section]['classes'].append({'title': exhibit_class_title + jury_group_title_suffix,
+                                                             'exhibits': [exhibit for exhibit in exhibits if (exhibit.jury_group or 0) == jury_group]})
+                    continue
+            sections[section]['classes'].append({'title': exhibit_class_title,
+                                                 'exhibits': exhibits})
+    else:
+        # Countries are listed even if all their exhibits are rejected
+        exhibit_countries = {}
+        for exhibit in Exhibit.objects.select_related('participant').order_by('participant__surname', 'pk'):
+            exhibit_classes = exhibit_countries.setdefault(country_names().get(exhibit.participant.country.code, ''), {})
+            if not exhibit.rejected:
+                exhibit_classes.setdefault(exhibit.exhibit_class, []).append(exhibit)
+
+        sections = OrderedDict()
+        for country in sorted(exhibit_countries):
+            exhibit_classes = []
+            for exhibit_class, exhibit_class_title in Exhibit.EXHIBIT_CLASS_CHOICES:
+                if exhibit_class not in exhibit_countries[country]:
+                    continue
+                exhibit_classes.append({'title': exhibit_class_title,
+                                        'exhibits': exhibit_countries[country][exhibit_class]})
+            sections[country] = {'title': country,
+                                 'classes': exhibit_classes}
+
+    return sections
+
+def render_exhibits(export_sort='class', extras=0, media_url=''):
+    return render_to_string('registrations/exhibits.html', {'exhibit_sections': exhibit_sections(export_sort, extras),
+                                                            'extras': extras,
+                                                            'media_url': media_url})
+
+def jury_media_members():
+    # Introductory pages and synopses of accepted exhibits, as (archive name, file) in class order,
+    # placed in a directory per class and jury group and named by start frame and title
+    class_order = {exhibit_class: index for index, (exhibit_class, title) in enumerate(Exhibit.EXHIBIT_CLASS_CHOICES)}
+    exhibits = sorted(Exhibit.objects.filter(rejected=False).only('exhibit_class', 'jury_group', 'start_frame', 'title', *Exhibit.FILE_FIELDS),
+                      key=lambda e: (class_order.get(e.exhibit_class, len(class_order)), e.jury_group or 0, e.start_frame or 0, e.pk))
+
+    members = []
+    names = set()
+    for exhibit in exhibits:
+        directory = exhibit.exhibit_class
+        if exhibit.jury_group:
+            directory += '/jury-group-%d' % exhibit.jury_group
+        for field, label in (('introductory_page', 'intro'), ('synopsis', 'synopsis')):
+            field_file = getattr(exhibit, field)
+            if not field_file:
+                continue
+            title = get_valid_filename(exhibit.title)[:100]
+            prefix = '%03d' % exhibit.start_frame if exhibit.start_frame else 'unassigned'
+            extension = os.path.splitext(field_file.name)[1].lower()
+            name = '%s/%s-%s-%s%s' % (directory, prefix, title, label, extension)
+            if name in names:
+                name = '%s/%s-%s-%d-%s%s' % (directory, prefix, title, exhibit.pk, label, extension)
+            names.add(name)
+            members.append((name, field_file))
+    return members
+
+def stream_media_zip(members):
+    # Exhibit files are mostly PDFs and images that are compressed already, so they are stored
+    # as they are, read and handed out in chunks, however large the bundle gets
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED, allowZip64=True) as zip_file:
+        for name, field_file in members:
+            storage = field_file.storage
+            try:
+                content = storage.open(field_file.name, 'rb')
+            except OSError:
+                # Skip files that are missing from the disk
+                continue
+            with content:
+                # Zip timestamps start from 1980
+                date_time = max(storage.get_modified_time(field_file.name).timetuple()[:6], (1980, 1, 1, 0, 0, 0))
+                zip_info = zipfile.ZipInfo(name, date_time=date_time)
+                zip_info.compress_type = zipfile.ZIP_STORED
+                zip_info.file_size = storage.size(field_file.name)
+                with zip_file.open(zip_info, mode='w') as member:
+                    for chunk in iter(lambda: content.read(STREAM_CHUNK_SIZE), b''):
+                        member.write(chunk)
+                        if stream.pending() >= STREAM_CHUNK_SIZE:
+                            yield stream.pop()
+            yield stream.pop()
+    yield stream.pop()
+
+# Export jobs run by the export_worker management command: kind -> (name, extension)
+EXPORT_JOB_FILES = {'RAW_CSV': ('export', 'zip'),
+                    'RAW_XLSX': ('export', 'xlsx'),
+                    'REPORT': ('report', 'xlsx'),
+                    'REPORT_INVENTORY': ('report', 'xlsx'),
+                    'EXHIBITS_CLASS': ('exhibits', 'html'),
+                    'EXHIBITS_JURY': ('exhibits', 'html'),
+                    'EXHIBITS_INTRO': ('exhibits', 'html'),
+                    'EXHIBITS_COUNTRY': ('exhibits', 'html')}
+
+EXPORT_JOB_EXHIBITS = {'EXHIBITS_CLASS': ('class', 0),
+                       'EXHIBITS_JURY': ('class', 1),
+                       'EXHIBITS_INTRO': ('class', 2),
+                       'EXHIBITS_COUNTRY': ('country', 0)}
+
+def raw_cache(export_type):
+    return ExportCache('raw', 'zip' if export_type == 'csv' else 'xlsx')
+
+def report_cache(report_type):
+    return ExportCache('report-inventory' if report_type == 'inventory' else 'report', 'xlsx')
+
+def exhibits_cache(export_sort, extras, media_url):
+    # Links to the intro/synopsis files depend on the host the listing was requested from
+    variant = 'exhibits-%s-%d' % ('class' if export_sort == 'class' else 'country', extras)
+    if extras == 2:
+        variant += '-%s' % hashlib.sha1(media_url.encode('utf-8')).hexdigest()[:8]
+    return ExportCache(variant, 'html')
+
+def write_export(kind, stream, progress=None, media_url=''):
+    if kind == 'RAW_CSV':
+        for data in stream_csv_zip(raw_csv_members(), progress):
+            stream.write(data)
+    elif kind == 'RAW_XLSX':
+        write_xlsx(stream, lambda workbook: write_raw_xlsx(workbook, progress=progress))
+    elif kind == 'REPORT':
+        write_xlsx(stream, lambda workbook: write_report_xlsx(workbook, progress=progress))
+    elif kind == 'REPORT_INVENTORY':
+        write_xlsx(stream, lambda workbook: write_report_xlsx(workbook, 'inventory', progress))
+    else:
+        export_sort, extras = EXPORT_JOB_EXHIBITS[kind]
+        stream.write(render_exhibits(export_sort, extras, media_url).encode('utf-8'))
+
+# Files written by the export command next to the CSV bundle
+EXPORT_COMMAND_FILES = OrderedDict([('REPORT', 'report.xlsx'),
+                                    ('REPORT_INVENTORY', 'report-inventory.xlsx'),
+                                    ('RAW_XLSX', 'export.xlsx'),
+                                    ('EXHIBITS_CLASS', 'exhibits-class.html'),
+                                    ('EXHIBITS_JURY', 'exhibits-jury.html'),
+                                    ('EXHIBITS_INTRO', 'exhibits-intro.html'),
+                                    ('EXHIBITS_COUNTRY', 'exhibits-country.html')])
+
+def export_process_init():
+    # Worker processes open their own database connections
+    if not apps.ready:
+        django.setup()
+    connections.close_all()
+
+def run_export_task(task, path, media_url=''):
+    # A task is either an export job kind or the name of a raw table
+    started = time.monotonic()
+    with export_snapshot():
+        if task in EXPORT_JOB_FILES:
+            with open(path, 'wb') as stream:
+                write_export(task, stream, media_url=media_url)
+        else:
+            with open(path, 'w', encoding='utf-8', newline='') as stream:
+                csv.writer(stream).writerows(dict(raw_tables())[task])
+    return task, time.monotonic() - started
+
+def export_job_cache(job):
+    if job.kind in ('RAW_CSV', 'RAW_XLSX'):
+        return raw_cache('csv' if job.kind == 'RAW_CSV' else 'xlsx')
+    if job.kind in ('REPORT', 'REPORT_INVENTORY'):
+        return report_cache('inventory' if job.kind == 'REPORT_INVENTORY' else '')
+    export_sort, extras = EXPORT_JOB_EXHIBITS[job.kind]
+    return exhibits_cache(export_sort, extras, job.media_url)
+
+def run_export_job(job):
+    kind_name, extension = EXPORT_JOB_FILES[job.kind]
+    name = export_name(kind_name)
+    try:
+        with export_snapshot():
+            cache = export_job_cache(job)
+            if not cache.exists():
+                cache.write(lambda stream: write_export(job.kind, stream, job.set_progress, job.media_url))
+        with cache.open() as stream:
+            job.artifact.save('%s.%s' % (name, extension), File(stream), save=False)
+        job.status = 'DONE'
+        job.progress = 100
+    except Exception:
+        job.status = 'FAILED'
+        job.message = traceback.format_exc()
+    job.finished_at = timezone.now()
+    job.save()
+
+def fail_stale_export_jobs():
+    # Jobs left running by a worker that died would otherwise never finish, nor expire
+    stale = timezone.now() - timedelta(seconds=settings.EXPORT_JOB_TIMEOUT)
+    return ExportJob.objects.filter(status='RUNNING', started_at__lt=stale).update(status='FAILED',
+                                                                                   message='The export worker stopped before finishing the job',
+                                                                                   finished_at=timezone.now())
+
+def remove_expired_export_jobs():
+    expired = timezone.now() - timedelta(days=settings.EXPORT_JOB_RETENTION_DAYS)
+    for job in ExportJob.objects.filter(created_at__lt=expired).exclude(status__in=('PENDING', 'RUNNING')):
+        job.delete()
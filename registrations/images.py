@@ -0,0 +1,111 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import io
+
+from PIL import Image, ImageOps
+from django.core.files.base import ContentFile
+from collections import OrderedDict
+
+
+# Largest stored photo, in pixels (larger uploads are scaled down)
+PHOTO_MAX_SIZE = (1200, 1200)
+PHOTO_JPEG_QUALITY = 85
+
+# Thumbnails are kept next to the photos, under thumbnails/<size>/
+PHOTO_THUMBNAIL_SIZES = OrderedDict([('small', (64, 64)),
+                                     ('medium', (240, 240))])
+
+def encode_image(image):
+    # JPEG, unless there is transparency to keep. Nothing from the original file
+    # (EXIF and other metadata) is carried over.
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        image_format, extension = 'PNG', 'png'
+    else:
+        image = image.convert('RGB')
+        image_format, extension = 'JPEG', 'jpg'
+    stream = io.BytesIO()
+    image.save(stream, image_format, quality=PHOTO_JPEG_QUALITY, optimize=True)
+    return ContentFile(stream.getvalue()), extension
+
+def open_image(field_file):
+    field_file.open('rb')
+    try:
+        image = Image.open(field_file)
+        image.load()
+    finally:
+        field_file.close()
+    # Phones store the orientation in EXIF, apply it to the pixels before the metadata is dropped
+    return ImageOps.exif_transpose(image)
+
+def scaled_image(image, size):
+    image = image.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    return image
+
+def thumbnail_name(name, size):
+    directory, filename = os.path.split(name)
+    return os.path.join(directory, 'thumbnails', size, filename)
+
+def thumbnail_source(name):
+    # Name of the photo a thumbnail was made from, or None if the name is not of a thumbnail
+    directory, filename = os.path.split(name)
+    directory, size = os.path.split(directory)
+    directory, thumbnails = os.path.split(directory)
+    if thumbnails != 'thumbnails' or size not in PHOTO_THUMBNAIL_SIZES:
+        return None
+    return os.path.join(directory, filename)
+
+def save_thumbnail(storage, name, image, size):
+    thumbnail = thumbnail_name(name, size)
+    if storage.exists(thumbnail):
+        storage.delete(thumbnail)
+    content, extension = encode_image(scaled_image(image, PHOTO_THUMBNAIL_SIZES[size]))
+    return storage.save(thumbnail, content)
+
+def delete_photo(storage, name):
+    storage.delete(name)
+    for size in PHOTO_THUMBNAIL_SIZES:
+        storage.delete(thumbnail_name(name, size))
+
+def thumbnail_url(field_file, size):
+    # Thumbnails missing for any reason are created on first use
+    name = thumbnail_name(field_file.name, size)
+    if not field_file.storage.exists(name):
+        name = save_thumbnail(field_file.storage, field_file.name, open_image(field_file), size)
+    return field_file.storage.url(name)
+
+def is_processed(field_file):
+    # Already stored as process_photo() would: small enough, no metadata and JPEG/PNG
+    field_file.open('rb')
+    try:
+        image = Image.open(field_file)
+        return (image.format in ('JPEG', 'PNG') and
+                image.width <= PHOTO_MAX_SIZE[0] and image.height <= PHOTO_MAX_SIZE[1] and
+                'exif' not in image.info)
+    finally:
+        field_file.close()
+
+def process_photo(field_file):
+    # Store a normalised copy in place of the given file: upright, without metadata
+    # and no larger than PHOTO_MAX_SIZE, along with its thumbnails
+    image = scaled_image(open_image(field_file), PHOTO_MAX_SIZE)
+    content, extension = encode_image(image)
+    field_file.save('%s.%s' % (os.path.splitext(os.path.basename(field_file.name))[0], extension), content, save=False)
+    for size in PHOTO_THUMBNAIL_SIZES:
+        save_thumbnail(field_file.storage, field_file.name, image, size)
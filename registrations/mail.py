@@ -0,0 +1,199 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db import transaction
+from django.db.models import Min, OuterRef, Subquery
+from django.template.loader import render_to_string
+from django.utils import timezone
+from datetime import timedelta
+
+from .models import Federation, Appointments, OutgoingEmail, CommissionerDigestEntry
+
+
+# Emails handed to the mail server per batch
+EMAIL_BATCH_SIZE = 50
+
+# Cache key of the commissioner routing table (cleared by signals when the data changes)
+ROUTING_CACHE_KEY = 'registrations:commissioner-routing'
+ROUTING_CACHE_TIMEOUT = 60 * 60
+
+def queue_mail(subject, message, from_email, recipient_list, html_message=None):
+    # Same arguments as send_mail(), but the email is sent later by the email_dispatcher command
+    return OutgoingEmail.objects.create(subject=subject,
+                                        message=message,
+                                        html_message=html_message or '',
+                                        from_email=from_email,
+                                        recipients=', '.join(recipient_list))
+
+def email_message(email, connection=None):
+    message = EmailMultiAlternatives(email.subject, email.message, email.from_email, email.recipient_list(), connection=connection)
+    if email.html_message:
+        message.attach_alternative(email.html_message, 'text/html')
+    return message
+
+def pending_emails(batch_size=EMAIL_BATCH_SIZE):
+    return list(OutgoingEmail.objects.filter(status='PENDING', next_attempt_at__lte=timezone.now()).order_by('next_attempt_at', 'id')[:batch_size])
+
+def email_failed(email, error):
+    # Retry after EMAIL_RETRY_DELAY seconds, doubling the delay on every attempt
+    email.attempts += 1
+    email.last_error = error
+    if email.attempts >= settings.EMAIL_MAX_ATTEMPTS:
+        email.status = 'FAILED'
+    else:
+        email.next_attempt_at = timezone.now() + timedelta(seconds=settings.EMAIL_RETRY_DELAY * 2 ** (email.attempts - 1))
+    email.save()
+
+def send_emails(emails, connection):
+    sent = 0
+    try:
+        connection.open()
+    except Exception as e:
+        for email in emails:
+            email_failed(email, repr(e))
+        return sent
+
+    for index, email in enumerate(emails):
+        try:
+            email_message(email, connection).send()
+        except Exception as e:
+            email_failed(email, repr(e))
+            # Reconnect once for the rest, in case the server dropped the connection,
+            # as a closed connection would otherwise be opened and closed for every message
+            connection.close()
+            try:
+                connection.open()
+            except Exception as e:
+                for email in emails[index + 1:]:
+                    email_failed(email, repr(e))
+                return sent
+            continue
+        email.attempts += 1
+        email.status = 'SENT'
+        email.sent_at = timezone.now()
+        email.save()
+        sent += 1
+    return sent
+
+def dispatch_emails(batch_size=EMAIL_BATCH_SIZE):
+    # Send everything that is due over one connection, batch by batch
+    sent = 0
+    connection = get_connection()
+    try:
+        while True:
+            emails = pending_emails(batch_size)
+            if not emails:
+                break
+            sent += send_emails(emails, connection)
+    finally:
+        connection.close()
+    return sent
+
+def build_routing_table():
+    # Per country code, the email of the first appointed commissioner, else the commissioner
+    # email or the addresses of the first federation, all in one query
+    commissioner_emails = Appointments.objects.filter(commissioner=True, federation__country_code=OuterRef('country_code')).order_by('pk').values('participant__email')[:1]
+    federations = Federation.objects.annotate(appointed_commissioner_email=Subquery(commissioner_emails)).order_by('pk')
+
+    routing_table = {}
+    for federation in federations:
+        if federation.country_code in routing_table:
+            continue
+        if federation.appointed_commissioner_email is not None:
+            routing_table[federation.country_code] = [federation.appointed_commissioner_email]
+        elif federation.commissioner_email:
+            routing_table[federation.country_code] = [federation.commissioner_email]
+        else:
+            routing_table[federation.country_code] = federation.email_list()
+    return routing_table
+
+def routing_table():
+    table = cache.get(ROUTING_CACHE_KEY)
+    if table is None:
+        table = build_routing_table()
+        cache.set(ROUTING_CACHE_KEY, table, ROUTING_CACHE_TIMEOUT)
+    return table
+
+def clear_routing_table():
+    cache.delete(ROUTING_CACHE_KEY)
+
+def commissioner_recipients(country_code):
+    email_to = routing_table().get(country_code)
+    if not email_to and settings.NO_COMMISSIONER_EMAIL:
+        email_to = [settings.NO_COMMISSIONER_EMAIL]
+    return email_to
+
+def exhibit_registration_message(digest=False):
+    if digest:
+        message = 'Dear Commissioner,<br />This is the entry form data we received from the prospective exhibitors of your country since our last email.'
+    else:
+        message = 'Dear Commissioner,<br />This is the entry form data we received from the prospective exhibitor of your country.'
+    message += '<br />(a) In case there are errors, please get in contact with the exhibitor and advise him/her to correct the errors and re-submit.<br />(b) If, however, you disapprove of the application, please '
+    if settings.GENERAL_COMMISSIONER_EMAIL:
+        message += 'email the General Commissioner at <a class="text-dark" href="mailto:%s">%s</a>.' % (settings.GENERAL_COMMISSIONER_EMAIL, settings.GENERAL_COMMISSIONER_EMAIL)
+    else:
+        message += 'email us at <a class="text-dark" href="mailto:%s">%s</a>.' % (settings.EXHIBITION_EMAIL, settings.EXHIBITION_EMAIL)
+    return message
+
+def exhibit_registration_sections(exhibit):
+    return [{'title': 'Personal',
+             'fields': exhibit.participant.printout(),
+             'subsections': []},
+            {'title': 'Entry',
+             'fields': exhibit.printout(),
+             'subsections': [{'title': 'Previous participation #%d' % (j + 1),
+                              'fields': participation.printout()} for j, participation in enumerate(exhibit.participations.all())]}]
+
+def queue_exhibit_registration(recipients, exhibit):
+    # In digest mode, only note that the exhibit changed, it is rendered when the digest is sent
+    if settings.COMMISSIONER_DIGEST_INTERVAL:
+        entry, created = CommissionerDigestEntry.objects.get_or_create(recipients=', '.join(recipients), exhibit=exhibit)
+        if not created:
+            # Keep the entry if a digest is being rendered from the previous version
+            entry.save(update_fields=['changed_at'])
+        return
+
+    title = 'Exhibit Registration'
+    content = render_to_string('registrations/email.html', {'title': title,
+                                                            'message': exhibit_registration_message(),
+                                                            'sections': exhibit_registration_sections(exhibit)})
+    queue_mail('%s - %s' % (settings.EXHIBITION_NAME, title), '%s (in HTML format)' % title, settings.EMAIL_HOST_USER, recipients, html_message=content)
+
+def queue_commissioner_digests():
+    # One email per recipient list, once its oldest entry has waited for the digest interval
+    due = timezone.now() - timedelta(seconds=settings.COMMISSIONER_DIGEST_INTERVAL)
+    recipient_lists = CommissionerDigestEntry.objects.values('recipients').annotate(first_created_at=Min('created_at')).filter(first_created_at__lte=due).values_list('recipients', flat=True)
+
+    title = 'Exhibit Registrations'
+    for recipients in list(recipient_lists):
+        with transaction.atomic():
+            read_at = timezone.now()
+            entries = list(CommissionerDigestEntry.objects.filter(recipients=recipients)
+                                                          .select_related('exhibit__participant')
+                                                          .prefetch_related('exhibit__participations')
+                                                          .order_by('created_at', 'id'))
+            sections = []
+            for entry in entries:
+                sections.extend(exhibit_registration_sections(entry.exhibit))
+            content = render_to_string('registrations/email.html', {'title': title,
+                                                                    'message': exhibit_registration_message(digest=True),
+                                                                    'sections': sections})
+            queue_mail('%s - %s' % (settings.EXHIBITION_NAME, title), '%s (in HTML format)' % title, settings.EMAIL_HOST_USER, recipients.split(', '), html_message=content)
+            # Entries changed since they were read go into the next digest
+            CommissionerDigestEntry.objects.filter(id__in=[entry.id for entry in entries], changed_at__lt=read_at).delete()
@@ -0,0 +1,54 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+
+from django.core.management.base import BaseCommand
+
+from registrations.models import Exhibit
+
+
+class Command(BaseCommand):
+    help = 'Delete exhibit files no exhibit refers to, optionally moving older uploads to content-addressed storage first'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--migrate', action='store_true', help='Store files uploaded before deduplication once per content')
+        parser.add_argument('--force', action='store_true', help='Also delete files stored or reused recently')
+
+    def migrate(self, storage):
+        for exhibit in Exhibit.objects.all():
+            for field in Exhibit.FILE_FIELDS:
+                field_file = getattr(exhibit, field)
+                # Content-addressed names are exhibit/<sha256>/<filename>
+                if not field_file or field_file.name.count('/') > 1:
+                    continue
+                original_name = field_file.name
+                try:
+                    with storage.open(original_name) as content:
+                        field_file.name = storage.save(os.path.join('exhibit', os.path.basename(original_name)), content)
+                except OSError as e:
+                    self.stderr.write('Skipping %s: %s' % (original_name, e))
+                    continue
+                Exhibit.objects.filter(pk=exhibit.pk).update(**{field: field_file.name})
+                self.stdout.write('%s -> %s' % (original_name, field_file.name))
+
+    def handle(self, *args, **options):
+        storage = Exhibit._meta.get_field('introductory_page').storage
+        if options['migrate']:
+            self.migrate(storage)
+
+        for name in Exhibit.collect_unreferenced_files(force=options['force']):
+            self.stdout.write('Deleted %s' % name)
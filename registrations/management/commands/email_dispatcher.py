@@ -0,0 +1,43 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from registrations.mail import EMAIL_BATCH_SIZE, dispatch_emails, queue_commissioner_digests
+
+
+class Command(BaseCommand):
+    help = 'Send the emails queued by the web application'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when there are no more emails due')
+        parser.add_argument('--interval', type=float, default=5, help='Seconds to wait between polls')
+        parser.add_argument('--batch-size', type=int, default=EMAIL_BATCH_SIZE, help='Emails fetched per query')
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            queue_commissioner_digests()
+            sent = dispatch_emails(options['batch_size'])
+            if sent:
+                self.stdout.write('Sent %d email(s)' % sent)
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,64 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import time
+import shutil
+import zipfile
+
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from registrations.export import EXPORT_COMMAND_FILES, export_name, raw_tables, raw_csv_directory, export_process_init, run_export_task
+
+
+class Command(BaseCommand):
+    help = 'Write the raw exports, reports and exhibit listings to a directory'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', help='Target directory (created if missing)')
+        parser.add_argument('--processes', type=int, default=os.cpu_count(), help='Number of worker processes')
+        parser.add_argument('--media-url', default=settings.MEDIA_URL, help='Prefix of the links to exhibit files')
+
+    def handle(self, *args, **options):
+        directory = options['directory']
+        name = export_name('export')
+        csv_directory = os.path.join(directory, name)
+        os.makedirs(csv_directory, exist_ok=True)
+
+        # Slowest files first, then one task per raw table
+        tasks = [(kind, os.path.join(directory, filename)) for kind, filename in EXPORT_COMMAND_FILES.items()]
+        tables = [(table, os.path.join(csv_directory, '%s.csv' % table)) for table, rows in raw_tables()]
+
+        # Do not hand the open connection over to the workers
+        connections.close_all()
+        started = time.monotonic()
+        with ProcessPoolExecutor(max_workers=options['processes'], initializer=export_process_init) as executor:
+            futures = [executor.submit(run_export_task, task, path, options['media_url']) for task, path in tasks + tables]
+            for future in as_completed(futures):
+                task, seconds = future.result()
+                self.stdout.write('%s: %.2fs' % (task, seconds))
+
+        # Bundle the tables as in the CSV export of the admin
+        with zipfile.ZipFile(os.path.join(directory, '%s.zip' % name), mode='w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+            for table, path in tables:
+                zip_file.write(path, '%s/%s.csv' % (raw_csv_directory(), table))
+        shutil.rmtree(csv_directory)
+
+        self.stdout.write(self.style.SUCCESS('Exported to %s in %.2fs' % (directory, time.monotonic() - started)))
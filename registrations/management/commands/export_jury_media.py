@@ -0,0 +1,36 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+
+from django.core.management.base import BaseCommand
+
+from registrations.export import export_name, jury_media_members, stream_media_zip
+
+
+class Command(BaseCommand):
+    help = 'Write the introductory pages and synopses of all accepted exhibits to a zip file, per class and jury group'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', help='Target file (defaults to a dated name in the current directory)')
+
+    def handle(self, *args, **options):
+        path = options['path'] or '%s.zip' % export_name('jury-media')
+        members = jury_media_members()
+        with open(path, 'wb') as stream:
+            for data in stream_media_zip(members):
+                stream.write(data)
+        self.stdout.write(self.style.SUCCESS('Wrote %d files to %s (%d bytes)' % (len(members), path, os.path.getsize(path))))
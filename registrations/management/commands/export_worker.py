@@ -0,0 +1,60 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from registrations.models import Exhibit, ExportJob
+from registrations.export import run_export_job, fail_stale_export_jobs, remove_expired_export_jobs
+from registrations.snapshot import refresh_stale_snapshot
+from registrations.catalogue import publish_changed_catalogue
+
+
+class Command(BaseCommand):
+    help = 'Run export jobs queued from the admin, keep the published catalogue up to date and delete unused exhibit files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Exit when there are no more pending jobs')
+        parser.add_argument('--interval', type=float, default=2, help='Seconds to wait between polls')
+
+    def handle(self, *args, **options):
+        collected_at = None
+        while True:
+            close_old_connections()
+            if settings.EXPORT_FROM_SNAPSHOT:
+                refresh_stale_snapshot()
+            if fail_stale_export_jobs():
+                self.stdout.write('Failed jobs left running')
+            job = ExportJob.claim()
+            if job:
+                self.stdout.write('Running %s job %d' % (job.kind, job.id))
+                run_export_job(job)
+                self.stdout.write('Job %d finished: %s' % (job.id, job.status))
+                continue
+
+            remove_expired_export_jobs()
+            if settings.PUBLISH_CATALOGUE and publish_changed_catalogue():
+                self.stdout.write('Published the catalogue')
+            if settings.EXHIBIT_FILES_COLLECT_INTERVAL and (collected_at is None or time.monotonic() - collected_at >= settings.EXHIBIT_FILES_COLLECT_INTERVAL):
+                for name in Exhibit.collect_unreferenced_files():
+                    self.stdout.write('Deleted %s' % name)
+                collected_at = time.monotonic()
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,43 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from django.core.management.base import BaseCommand
+
+from registrations.models import Participant
+from registrations.images import is_processed, process_photo, delete_photo
+
+
+class Command(BaseCommand):
+    help = 'Normalise participant photos uploaded before photos were processed, and create their thumbnails'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Process photos that look processed already')
+
+    def handle(self, *args, **options):
+        for participant in Participant.objects.exclude(photo=''):
+            original_name = participant.photo.name
+            try:
+                if not options['force'] and is_processed(participant.photo):
+                    continue
+                process_photo(participant.photo)
+            except Exception as e:
+                self.stderr.write('Skipping %s: %s' % (original_name, e))
+                continue
+            participant.save()
+
+            # The processed photo is always stored under a new name, as the original still existed
+            delete_photo(participant.photo.storage, original_name)
+            self.stdout.write('%s -> %s' % (original_name, participant.photo.name))
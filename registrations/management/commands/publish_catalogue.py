@@ -0,0 +1,35 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from registrations.catalogue import CATALOGUE_FILES, catalogue_state, published_state, publish_catalogue
+
+
+class Command(BaseCommand):
+    help = 'Render the public exhibit listings to static files in CATALOGUE_ROOT'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Render the files even if no exhibit changed')
+
+    def handle(self, *args, **options):
+        state = catalogue_state()
+        if not options['force'] and state == published_state():
+            self.stdout.write('The catalogue is up to date')
+            return
+        publish_catalogue(state)
+        self.stdout.write(self.style.SUCCESS('Published %s in %s' % (', '.join(CATALOGUE_FILES), settings.CATALOGUE_ROOT)))
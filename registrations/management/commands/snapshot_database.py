@@ -0,0 +1,27 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from django.core.management.base import BaseCommand
+
+from registrations.snapshot import snapshot_path, refresh_snapshot
+
+
+class Command(BaseCommand):
+    help = 'Refresh the database snapshot that exports read from'
+
+    def handle(self, *args, **options):
+        taken_at = refresh_snapshot()
+        self.stdout.write('Snapshot taken at %s in %s' % (taken_at.isoformat(), snapshot_path()))
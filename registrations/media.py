@@ -0,0 +1,72 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import posixpath
+import mimetypes
+
+from urllib.parse import quote
+
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, FileResponse
+from django.utils.http import http_date
+
+from .models import Participant, Exhibit
+from .images import thumbnail_source
+
+
+def media_name(path):
+    # Normalised name of the file under MEDIA_ROOT, or None if the path points outside of it
+    name = posixpath.normpath(path).lstrip('/')
+    if not name or name == '.' or name.startswith('..') or '\x00' in name:
+        return None
+    return name
+
+def media_allowed(user, name):
+    # Staff see everything, registrants only their own photo and exhibit files
+    if user.is_staff:
+        return True
+    if name.startswith('participant/'):
+        return Participant.objects.filter(user=user, photo=thumbnail_source(name) or name).exists()
+    if name.startswith('exhibit/'):
+        return Exhibit.objects.filter(Q(introductory_page=name) | Q(synopsis=name), participant__user=user).exists()
+    return False
+
+def media_response(name):
+    # Apache (X-Sendfile) or nginx (X-Accel-Redirect) send the file once access is checked,
+    # so that large transfers do not occupy the web workers. Without either, Django sends it.
+    path = os.path.join(settings.MEDIA_ROOT, name)
+    if not os.path.isfile(path):
+        return None
+
+    content_type, encoding = mimetypes.guess_type(path)
+    content_type = content_type or 'application/octet-stream'
+    sendfile = getattr(settings, 'MEDIA_SENDFILE', '')
+    if sendfile == 'X-Sendfile':
+        response = HttpResponse(content_type=content_type)
+        # Header values are sent as Latin-1, so pass the UTF-8 bytes of the path to have
+        # names such as Greek ones arrive unchanged (strings would be MIME-encoded instead)
+        response['X-Sendfile'] = path.encode('utf-8')
+    elif sendfile == 'X-Accel-Redirect':
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = quote(settings.MEDIA_ACCEL_REDIRECT_PREFIX + name)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response['Last-Modified'] = http_date(os.path.getmtime(path))
+    # Only the browser of the user that was allowed may keep a copy
+    response['Cache-Control'] = 'private, max-age=3600'
+    return response
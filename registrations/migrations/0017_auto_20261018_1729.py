@@ -0,0 +1,52 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:29
+
+from django.db import migrations, models
+import registrations.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registrations', '0016_auto_20211026_1312'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeletedExhibit',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('exhibit_id', models.IntegerField()),
+                ('deleted_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Deleted Exhibit',
+                'verbose_name_plural': 'Deleted Exhibits',
+            },
+            bases=(models.Model, registrations.models.ExportMixin),
+        ),
+        migrations.AlterField(
+            model_name='appointments',
+            name='changed_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='exhibit',
+            name='changed_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='exhibitparticipation',
+            name='changed_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='participant',
+            name='changed_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='traveldetails',
+            name='changed_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import registrations.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('registrations', '0017_auto_20261018_1729'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('RAW_CSV', 'Export to CSV'), ('RAW_XLSX', 'Export to XLSX'), ('REPORT', 'XLSX report'), ('REPORT_INVENTORY', 'XLSX report (inventory, no literature)'), ('EXHIBITS_CLASS', 'Exhibits in HTML (per class)'), ('EXHIBITS_JURY', 'Exhibits in HTML (per class, plus jury groups)'), ('EXHIBITS_INTRO', 'Exhibits in HTML (per class, plus jury groups and intro/synopsis)'), ('EXHIBITS_COUNTRY', 'Exhibits in HTML (per country)')], max_length=32)),
+                ('status', models.CharField(choices=[('PENDING', 'Pending'), ('RUNNING', 'Running'), ('DONE', 'Done'), ('FAILED', 'Failed')], default='PENDING', max_length=8)),
+                ('progress', models.IntegerField(default=0, help_text='Percent complete')),
+                ('message', models.TextField(blank=True)),
+                ('artifact', models.FileField(blank=True, storage=registrations.storage.ExportStorage(), upload_to='')),
+                ('media_url', models.CharField(blank=True, help_text='Absolute media URL for links in HTML exports', max_length=256)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('requested_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='export_jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Export Job',
+                'verbose_name_plural': 'Export Jobs',
+            },
+        ),
+    ]
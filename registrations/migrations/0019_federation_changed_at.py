@@ -0,0 +1,18 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registrations', '0018_exportjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='federation',
+            name='changed_at',
+            field=models.DateTimeField(auto_now=True, db_index=True, null=True),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registrations', '0020_outgoingemail'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CommissionerDigestEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipients', models.CharField(help_text='Comma-separated list of addresses', max_length=512)),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('changed_at', models.DateTimeField(auto_now=True)),
+                ('exhibit', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='digest_entries', to='registrations.Exhibit')),
+            ],
+            options={
+                'verbose_name': 'Commissioner Digest Entry',
+                'verbose_name_plural': 'Commissioner Digest Entries',
+                'unique_together': {('recipients', 'exhibit')},
+            },
+        ),
+    ]
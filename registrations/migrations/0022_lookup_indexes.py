@@ -0,0 +1,48 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:42
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+import django.db.models.deletion
+
+
+def check_participant_users(apps, schema_editor):
+    # The unique constraint would fail with an obscure integrity error, so name the accounts
+    # that have more than one participant, to be merged or detached in the admin first
+    Participant = apps.get_model('registrations', 'Participant')
+    duplicates = Participant.objects.filter(user__isnull=False).values('user').annotate(count=Count('id')).filter(count__gt=1)
+    user_ids = sorted(duplicate['user'] for duplicate in duplicates)
+    if user_ids:
+        raise RuntimeError('Users with more than one participant (ids %s), leave one participant per user before migrating' % ', '.join(str(user_id) for user_id in user_ids))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registrations', '0021_commissionerdigestentry'),
+    ]
+
+    operations = [
+        migrations.RunPython(check_participant_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='federation',
+            name='country_code',
+            field=models.CharField(db_index=True, max_length=2),
+        ),
+        migrations.AlterField(
+            model_name='participant',
+            name='user',
+            field=models.OneToOneField(null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='appointments',
+            index=models.Index(fields=['commissioner', 'federation'], name='appointments_commissioner'),
+        ),
+        migrations.AddIndex(
+            model_name='exhibit',
+            index=models.Index(fields=['exhibit_class', 'rejected', 'start_frame'], name='exhibit_class_frame'),
+        ),
+        migrations.AddIndex(
+            model_name='exhibit',
+            index=models.Index(fields=['rejected', 'start_frame'], name='exhibit_rejected_frame'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.13 on 2026-10-18 17:49
+
+from django.db import migrations, models
+import registrations.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('registrations', '0022_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='exhibit',
+            name='introductory_page',
+            field=models.FileField(max_length=255, storage=registrations.storage.ContentAddressedStorage(), upload_to='exhibit/'),
+        ),
+        migrations.AlterField(
+            model_name='exhibit',
+            name='synopsis',
+            field=models.FileField(blank=True, max_length=255, storage=registrations.storage.ContentAddressedStorage(), upload_to='exhibit/'),
+        ),
+    ]
@@ -17,14 +17,34 @@
 import os
 import io
 import csv
+import functools
 
 from django.db import models
 from django.conf import settings
 from django_countries import countries
 from django_countries.fields import CountryField
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from collections import OrderedDict
 
+from .storage import ExportStorage, ContentAddressedStorage
+from .images import process_photo, thumbnail_url
+
+
+# Rows fetched per query while exporting (also bounds the IN lists, SQLite allows 999 parameters)
+EXPORT_CHUNK_SIZE = 500
+
+
+@functools.lru_cache(maxsize=None)
+def country_names():
+    # Built on first use, as translations are not available while the models load
+    return dict(countries)
+
+def export_value(value):
+    return str(value) if value else ''
+
+def export_text(value):
+    return '\n'.join(value.splitlines()) if value else ''
 
 class ExportMixin():
     @classmethod
@@ -32,48 +52,98 @@ class ExportMixin():
         return list(cls._export_fields.keys())
 
     @classmethod
-    def export_to_csv(cls):
+    def export_serializer(cls):
+        # Built once per model: the columns to fetch with values_list() and how to
+        # convert each value, so that only text columns get their newlines normalised
+        if '_export_serializer' not in cls.__dict__:
+            converters = []
+            for field in cls._export_fields.values():
+                if isinstance(cls._meta.get_field(field), (models.CharField, models.TextField, models.FileField)):
+                    converters.append(export_text)
+                else:
+                    converters.append(export_value)
+            cls._export_serializer = (list(cls._export_fields.values()), converters)
+        return cls._export_serializer
+
+    @classmethod
+    def export_serialize(cls, row):
+        converters = cls.export_serializer()[1]
+        return [convert(value) for convert, value in zip(converters, row)]
+
+    @classmethod
+    def export_queryset(cls, since=None):
+        # Only rows created or modified after since, if given
+        if since is None:
+            return cls.objects.all()
+        return cls.objects.filter(changed_at__gt=since)
+
+    @classmethod
+    def export_rows(cls, since=None):
+        fields = cls.export_serializer()[0]
+        yield cls.export_keys()
+        for row in cls.export_queryset(since).values_list(*fields).iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield cls.export_serialize(row)
+
+    @staticmethod
+    def export_chunks(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+        # Page through a values_list() queryset that starts with the primary key,
+        # so that related rows can be fetched once per chunk
+        queryset = queryset.order_by('pk')
+        last_pk = None
+        while True:
+            chunk = list((queryset.filter(pk__gt=last_pk) if last_pk is not None else queryset)[:chunk_size])
+            if chunk:
+                yield chunk
+            if len(chunk) < chunk_size:
+                break
+            last_pk = chunk[-1][0]
+
+    @classmethod
+    def export_choices_rows(cls, choices):
+        yield ['id', 'value']
+        for key, value in choices:
+            yield [key, value]
+
+    @classmethod
+    def export_countries_rows(cls):
+        return cls.export_choices_rows(list(countries))
+
+    @staticmethod
+    def rows_to_csv(rows):
         stream = io.StringIO()
         writer = csv.writer(stream)
-        writer.writerow(cls.export_keys())
-        for instance in cls.objects.all():
-            writer.writerow(instance.export_values())
+        writer.writerows(rows)
         return stream.getvalue()
 
+    @staticmethod
+    def rows_to_xlsx(workbook, name, rows):
+        worksheet = workbook.add_worksheet(name)
+        for row, values in enumerate(rows):
+            worksheet.write_row(row, 0, values)
+
+    @classmethod
+    def export_to_csv(cls, since=None):
+        return cls.rows_to_csv(cls.export_rows(since))
+
     @classmethod
     def export_choices_to_csv(cls, choices):
-        stream = io.StringIO()
-        writer = csv.writer(stream)
-        writer.writerow(['id', 'value'])
-        for key, value in choices:
-            writer.writerow([key, value])
-        return stream.getvalue()
+        return cls.rows_to_csv(cls.export_choices_rows(choices))
 
     @classmethod
     def export_countries_to_csv(cls):
-        return cls.export_choices_to_csv(list(countries))
+        return cls.rows_to_csv(cls.export_countries_rows())
 
     @classmethod
-    def export_to_xlsx(cls, workbook, name):
-        row = 0
-        worksheet = workbook.add_worksheet(name)
-        worksheet.write_row(row, 0, cls.export_keys())
-        for instance in cls.objects.all():
-            row += 1
-            worksheet.write_row(row, 0, instance.export_values())
+    def export_to_xlsx(cls, workbook, name, since=None):
+        cls.rows_to_xlsx(workbook, name, cls.export_rows(since))
 
     @classmethod
     def export_choices_to_xlsx(cls, workbook, name, choices):
-        row = 0
-        worksheet = workbook.add_worksheet(name)
-        worksheet.write_row(row, 0, ['id', 'value'])
-        for key, value in choices:
-            row += 1
-            worksheet.write_row(row, 0, [key, value])
+        cls.rows_to_xlsx(workbook, name, cls.export_choices_rows(choices))
 
     @classmethod
     def export_countries_to_xlsx(cls, workbook, name):
-        return cls.export_choices_to_xlsx(workbook, name, list(countries))
+        cls.rows_to_xlsx(workbook, name, cls.export_countries_rows())
 
     def export_values(self):
         values = []
@@ -94,8 +164,10 @@ class Participant(models.Model, ExportMixin):
                      ('NONE', 'None')]
     LANGUAGE_CHOICES = [('EN', 'English'),
                         settings.NATIVE_COMMUNICATION_LANGUAGE]
+    TITLE_NAMES = dict(TITLE_CHOICES)
+    LANGUAGE_NAMES = dict(LANGUAGE_CHOICES)
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL)
 
     title = models.CharField(max_length=4, choices=TITLE_CHOICES, default='MR')
     surname = models.CharField(max_length=128)
@@ -110,7 +182,7 @@ class Participant(models.Model, ExportMixin):
     remarks = models.TextField(blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    changed_at = models.DateTimeField(auto_now=True)
+    changed_at = models.DateTimeField(auto_now=True, db_index=True)
 
     _export_fields = OrderedDict([('id', 'id'),
                                   ('title_id', 'title'),
@@ -125,41 +197,89 @@ class Participant(models.Model, ExportMixin):
                                   ('remarks', 'remarks')])
 
     @classmethod
-    def export_to_csv(cls):
-        stream = io.StringIO()
-        writer = csv.writer(stream)
-        writer.writerow(cls.export_keys() + Appointments.export_keys() + TravelDetails.export_keys())
-        for participant in Participant.objects.all():
-            appointments = participant.appointments.first() if participant.appointments.count() else Appointments()
-            travel_details = participant.travel_details.first() if participant.travel_details.count() else TravelDetails()
-            writer.writerow(participant.export_values() + appointments.export_values() + travel_details.export_values())
-        return stream.getvalue()
+    def export_queryset(cls, since=None):
+        # Registrant rows include appointments and travel details, so follow changes in those too
+        if since is None:
+            return cls.objects.all()
+        return cls.objects.filter(models.Q(changed_at__gt=since) |
+                                  models.Q(pk__in=Appointments.objects.filter(changed_at__gt=since).values('participant_id')) |
+                                  models.Q(pk__in=TravelDetails.objects.filter(changed_at__gt=since).values('participant_id')))
+
+    @staticmethod
+    def export_first_rows(model, participant_ids):
+        # Serialized first appointments/travel details (as in .first()) of the given participants
+        rows = {}
+        fields = model.export_serializer()[0]
+        for row in model.objects.filter(participant_id__in=participant_ids).order_by('-pk').values_list('participant_id', *fields):
+            rows[row[0]] = model.export_serialize(row[1:])
+        return rows
 
     @classmethod
-    def export_to_xlsx(cls, workbook, name):
-        row = 0
-        worksheet = workbook.add_worksheet(name)
-        worksheet.write_row(row, 0, cls.export_keys() + Appointments.export_keys() + TravelDetails.export_keys())
-        for participant in Participant.objects.all():
-            row += 1
-            appointments = participant.appointments.first() if participant.appointments.count() else Appointments()
-            travel_details = participant.travel_details.first() if participant.travel_details.count() else TravelDetails()
-            worksheet.write_row(row, 0, participant.export_values() + appointments.export_values() + travel_details.export_values())
+    def export_rows(cls, since=None):
+        yield cls.export_keys() + Appointments.export_keys() + TravelDetails.export_keys()
+        empty_appointments = Appointments().export_values()
+        empty_travel_details = TravelDetails().export_values()
+        queryset = cls.export_queryset(since).values_list('pk', *cls.export_serializer()[0])
+        for chunk in cls.export_chunks(queryset):
+            participant_ids = [row[0] for row in chunk]
+            appointments = cls.export_first_rows(Appointments, participant_ids)
+            travel_details = cls.export_first_rows(TravelDetails, participant_ids)
+            for row in chunk:
+                yield (cls.export_serialize(row[1:]) +
+                       appointments.get(row[0], empty_appointments) +
+                       travel_details.get(row[0], empty_travel_details))
+
+    @classmethod
+    def registration_state(cls, user):
+        # The participant of the user (None if not registered yet), annotated with what the
+        # registration steps need: the ids of the first appointments/travel details and
+        # whether there are any exhibits
+        first_appointments = Appointments.objects.filter(participant=models.OuterRef('pk')).order_by('pk').values('pk')[:1]
+        first_travel_details = TravelDetails.objects.filter(participant=models.OuterRef('pk')).order_by('pk').values('pk')[:1]
+        try:
+            return cls.objects.annotate(first_appointments_id=models.Subquery(first_appointments),
+                                        first_travel_details_id=models.Subquery(first_travel_details),
+                                        has_exhibits=models.Exists(Exhibit.objects.filter(participant=models.OuterRef('pk')))).get(user=user)
+        except cls.DoesNotExist:
+            return None
+
+    @classmethod
+    def printout_state(cls, user):
+        # The newest change and the number of rows of everything shown in the printout of the
+        # user, in a single aggregate query (counts catch removed exhibits and participations)
+        return cls.objects.filter(user=user).aggregate(id=models.Max('id'),
+                                                       participant=models.Max('changed_at'),
+                                                       appointments=models.Max('appointments__changed_at'),
+                                                       federation=models.Max('appointments__federation__changed_at'),
+                                                       exhibits=models.Max('exhibits__changed_at'),
+                                                       participations=models.Max('exhibits__participations__changed_at'),
+                                                       travel_details=models.Max('travel_details__changed_at'),
+                                                       exhibit_count=models.Count('exhibits', distinct=True),
+                                                       participation_count=models.Count('exhibits__participations', distinct=True))
+
+    def save(self, *args, **kwargs):
+        # New uploads are normalised before they reach the storage
+        if self.photo and not self.photo._committed:
+            process_photo(self.photo)
+        super().save(*args, **kwargs)
+
+    def photo_thumbnail_url(self, size='small'):
+        return thumbnail_url(self.photo, size) if self.photo else ''
 
     def full_name(self):
         return '%s, %s, %s' % (self.surname,
                                self.name,
-                               dict(self.TITLE_CHOICES)[self.title])
+                               self.TITLE_NAMES[self.title])
     full_name.short_description = 'Full name'
 
     def printout(self, all_fields=False):
-        result = OrderedDict([('Title', dict(self.TITLE_CHOICES)[self.title]),
+        result = OrderedDict([('Title', self.TITLE_NAMES[self.title]),
                               ('Name', self.name),
                               ('Surname', self.surname),
-                              ('Photo', os.path.basename(self.photo.path) if self.photo else ''),
+                              ('Photo', os.path.basename(self.photo.name) if self.photo else ''),
                               ('Address', self.address),
-                              ('Country', self.country.name),
-                              ('Language', dict(self.LANGUAGE_CHOICES)[self.language]),
+                              ('Country', country_names().get(self.country.code, '')),
+                              ('Language', self.LANGUAGE_NAMES[self.language]),
                               ('Email', self.email),
                               ('Mobile', self.mobile),
                               ('Telephone', self.telephone),
@@ -171,11 +291,14 @@ class Participant(models.Model, ExportMixin):
 
 class Federation(models.Model, ExportMixin):
     country = models.CharField(max_length=32)
-    country_code = models.CharField(max_length=2)
+    country_code = models.CharField(max_length=2, db_index=True)
     name = models.CharField(max_length=128)
     commissioner_email = models.CharField(max_length=128, null=True, blank=True, help_text='Used if no commissioner has registered')
     email = models.CharField(max_length=128)
 
+    # Not set for federations loaded from the fixture
+    changed_at = models.DateTimeField(auto_now=True, null=True, db_index=True)
+
     _export_fields = OrderedDict([('id', 'id'),
                                   ('country', 'country'),
                                   ('country_code', 'country_code'),
@@ -183,6 +306,11 @@ class Federation(models.Model, ExportMixin):
                                   ('commissioner_email', 'commissioner_email'),
                                   ('email', 'email')])
 
+    @classmethod
+    def export_queryset(cls, since=None):
+        # Federations loaded from the fixture carry no timestamps, so always export them all
+        return cls.objects.all()
+
     def full_name(self):
         return 'FED %s - %s' % (self.country,
                                 self.name)
@@ -200,10 +328,12 @@ class Appointments(models.Model, ExportMixin):
     ACCREDITED_JUROR_CHOICES = [('FIP', 'FIP'),
                                 ('FEPA', 'FEPA'),
                                 ('NAT', 'National')]
+    ACCREDITED_JUROR_NAMES = dict(ACCREDITED_JUROR_CHOICES)
 
     class Meta:
         verbose_name = 'Appointments'
         verbose_name_plural = 'Appointments'
+        indexes = [models.Index(fields=['commissioner', 'federation'], name='appointments_commissioner')]
 
     participant = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='appointments')
 
@@ -217,7 +347,7 @@ class Appointments(models.Model, ExportMixin):
     team_leader_disciplines = models.CharField(blank=True, max_length=128)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    changed_at = models.DateTimeField(auto_now=True)
+    changed_at = models.DateTimeField(auto_now=True, db_index=True)
 
     _export_fields = OrderedDict([('federation_id', 'federation_id'),
                                   ('commissioner', 'commissioner'),
@@ -233,7 +363,7 @@ class Appointments(models.Model, ExportMixin):
                               ('Appointed national commissioner', 'Yes' if self.commissioner else 'No'),
                               ('Proposed as jury member', 'Yes' if self.jury else 'No'),
                               ('Proposed as apprentice jury member', 'Yes' if self.apprentice_jury else 'No'),
-                              ('Accredited juror', dict(self.ACCREDITED_JUROR_CHOICES)[self.accredited_juror] if self.accredited_juror else ''),
+                              ('Accredited juror', self.ACCREDITED_JUROR_NAMES[self.accredited_juror] if self.accredited_juror else ''),
                               ('Accredited juror discipline(s)', self.accredited_juror_disciplines),
                               ('Team leader', 'Yes' if self.team_leader else 'No'),
                               ('Team leader discipline(s)', self.team_leader_disciplines)])
@@ -270,6 +400,12 @@ class Exhibit(models.Model, ExportMixin):
                              ('L7', 'L7. Philatelic Literature – Software'),
                              ('L8', 'L8. Philatelic Literature – Other digital works')]
     FRAME_CHOICES = [(0, 'None')] + [(f, f) for f in range(1, 9)]
+    EXHIBIT_CLASS_NAMES = dict(EXHIBIT_CLASS_CHOICES)
+
+    class Meta:
+        # Listings by class (admin filter, per-class exports) and of all accepted exhibits by frame
+        indexes = [models.Index(fields=['exhibit_class', 'rejected', 'start_frame'], name='exhibit_class_frame'),
+                   models.Index(fields=['rejected', 'start_frame'], name='exhibit_rejected_frame')]
 
     participant = models.ForeignKey(Participant, on_delete=models.CASCADE, related_name='exhibits')
 
@@ -279,8 +415,8 @@ class Exhibit(models.Model, ExportMixin):
     jury_group = models.IntegerField(null=True, blank=True)
     date_of_birth = models.DateField(null=True, blank=True, help_text='Youth philately only')
     frames = models.IntegerField(choices=FRAME_CHOICES)
-    introductory_page = models.FileField(upload_to='exhibit/')
-    synopsis = models.FileField(upload_to='exhibit/', blank=True)
+    introductory_page = models.FileField(upload_to='exhibit/', storage=ContentAddressedStorage(), max_length=255)
+    synopsis = models.FileField(upload_to='exhibit/', storage=ContentAddressedStorage(), max_length=255, blank=True)
     remarks = models.TextField(blank=True)
 
     author = models.CharField(max_length=256, blank=True)
@@ -299,7 +435,7 @@ class Exhibit(models.Model, ExportMixin):
     received = models.BooleanField(default=False)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    changed_at = models.DateTimeField(auto_now=True)
+    changed_at = models.DateTimeField(auto_now=True, db_index=True)
 
     _export_fields = OrderedDict([('id', 'id'),
                                   ('registrant_id', 'participant_id'),
@@ -329,13 +465,13 @@ class Exhibit(models.Model, ExportMixin):
     def printout(self, all_fields=False):
         result = OrderedDict([('Title', self.title),
                               ('Short description', self.short_description),
-                              ('Exhibit class', dict(self.EXHIBIT_CLASS_CHOICES)[self.exhibit_class]),
+                              ('Exhibit class', self.EXHIBIT_CLASS_NAMES[self.exhibit_class]),
                               ('Frames', self.frames)])
         if all_fields or self.exhibit_class.startswith('Y'):
             result.update(OrderedDict([('Date of birth', self.date_of_birth)]))
         if all_fields or self.exhibit_class.startswith('L'):
-            result.update(OrderedDict([('Front cover', os.path.basename(self.introductory_page.path)),
-                                       ('Short abstract', os.path.basename(self.synopsis.path) if self.synopsis else ''),
+            result.update(OrderedDict([('Front cover', os.path.basename(self.introductory_page.name)),
+                                       ('Short abstract', os.path.basename(self.synopsis.name) if self.synopsis else ''),
                                        ('Author', self.author),
                                        ('Publisher', self.publisher),
                                        ('Year of publication', self.year_of_publication or ''),
@@ -347,8 +483,8 @@ class Exhibit(models.Model, ExportMixin):
                                        ('Availability', self.availability),
                                        ('Price', self.price)]))
         else:
-            result.update(OrderedDict([('Introductory page', os.path.basename(self.introductory_page.path)),
-                                       ('Synopsis', os.path.basename(self.synopsis.path) if self.synopsis else '')]))
+            result.update(OrderedDict([('Introductory page', os.path.basename(self.introductory_page.name)),
+                                       ('Synopsis', os.path.basename(self.synopsis.name) if self.synopsis else '')]))
         result.update(OrderedDict([('Remarks', self.remarks)]))
         if all_fields:
             result.update(OrderedDict([('Rejected', 'Yes' if self.rejected else 'No'),
@@ -360,6 +496,66 @@ class Exhibit(models.Model, ExportMixin):
     def __str__(self):
         return self.title
 
+    @classmethod
+    def listing_state(cls):
+        # The newest change and the number of exhibits and their participants, in a single
+        # aggregate query (the count catches deletions)
+        return cls.objects.aggregate(exhibits=models.Max('changed_at'),
+                                     participants=models.Max('participant__changed_at'),
+                                     count=models.Count('id'))
+
+    # Uploaded files are shared between exhibits with the same content
+    FILE_FIELDS = ('introductory_page', 'synopsis')
+
+    def file_names(self):
+        return {getattr(self, field).name for field in self.FILE_FIELDS if getattr(self, field)}
+
+    @classmethod
+    def file_references(cls, name):
+        return cls.objects.filter(models.Q(introductory_page=name) | models.Q(synopsis=name)).count()
+
+    @classmethod
+    def collect_files(cls, names, force=False):
+        # Delete the given files if no exhibit refers to them any more. Unless forced, files
+        # stored or reused recently are kept, as their exhibit may not have been saved yet.
+        storage = cls._meta.get_field('introductory_page').storage
+        collected = []
+        for name in names:
+            if not name or cls.file_references(name):
+                continue
+            if not force and storage.is_recent(name):
+                continue
+            storage.delete(name)
+            collected.append(name)
+        return collected
+
+    @classmethod
+    def collect_unreferenced_files(cls, force=False):
+        # Delete all stored files no exhibit refers to, such as uploads of forms that were never saved
+        storage = cls._meta.get_field('introductory_page').storage
+        referenced = set()
+        for names in cls.objects.values_list(*cls.FILE_FIELDS):
+            referenced.update(names)
+        return cls.collect_files([name for name in storage.stored_names('exhibit') if name not in referenced], force=force)
+
+class DeletedExhibit(models.Model, ExportMixin):
+    class Meta:
+        verbose_name = 'Deleted Exhibit'
+        verbose_name_plural = 'Deleted Exhibits'
+
+    exhibit_id = models.IntegerField()
+
+    deleted_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    _export_fields = OrderedDict([('exhibit_id', 'exhibit_id'),
+                                  ('deleted_at', 'deleted_at')])
+
+    @classmethod
+    def export_queryset(cls, since=None):
+        if since is None:
+            return cls.objects.all()
+        return cls.objects.filter(deleted_at__gt=since)
+
 class ExhibitParticipation(models.Model, ExportMixin):
     EXHIBITION_LEVEL_CHOICES = [('WORLD', 'FIP World'),
                                 ('CONT', 'FEPA/FIAF/FIAP Continental'),
@@ -376,6 +572,8 @@ class ExhibitParticipation(models.Model, ExportMixin):
                      ('S', 'Silver'),
                      ('SB', 'Silver Bronze'),
                      ('B', 'Bronze')]
+    EXHIBITION_LEVEL_NAMES = dict(EXHIBITION_LEVEL_CHOICES)
+    MEDAL_NAMES = dict(MEDAL_CHOICES)
 
     class Meta:
         verbose_name = 'Exhibit Participation'
@@ -391,7 +589,7 @@ class ExhibitParticipation(models.Model, ExportMixin):
     felicitations = models.BooleanField()
 
     created_at = models.DateTimeField(auto_now_add=True)
-    changed_at = models.DateTimeField(auto_now=True)
+    changed_at = models.DateTimeField(auto_now=True, db_index=True)
 
     _export_fields = OrderedDict([('id', 'id'),
                                   ('exhibit_id', 'exhibit_id'),
@@ -402,15 +600,23 @@ class ExhibitParticipation(models.Model, ExportMixin):
                                   ('special_prize', 'special_prize'),
                                   ('felicitations', 'felicitations')])
 
+    @classmethod
+    def export_queryset(cls, since=None):
+        # Resend all participations of a changed exhibit, as removed ones leave no trace
+        if since is None:
+            return cls.objects.all()
+        return cls.objects.filter(models.Q(changed_at__gt=since) |
+                                  models.Q(exhibit_id__in=Exhibit.objects.filter(changed_at__gt=since).values('id')))
+
     # def clean(self):
     #     if self.exhibit.participations.count() >= 6:
     #         raise ValidationError('Please enter up to a maximum of 6 participations per exhibit')
 
     def printout(self, all_fields=False):
-        result = OrderedDict([('Exhibition level', dict(self.EXHIBITION_LEVEL_CHOICES)[self.exhibition_level]),
+        result = OrderedDict([('Exhibition level', self.EXHIBITION_LEVEL_NAMES[self.exhibition_level]),
                               ('Exhibition name', self.exhibition_name),
                               ('Points', self.points),
-                              ('Award/Medal', dict(self.MEDAL_CHOICES)[self.medal] if self.medal else ''),
+                              ('Award/Medal', self.MEDAL_NAMES[self.medal] if self.medal else ''),
                               ('Special prize', 'Yes' if self.special_prize else 'No'),
                               ('Felicitations', 'Yes' if self.felicitations else 'No')])
         return result
@@ -435,7 +641,7 @@ class TravelDetails(models.Model, ExportMixin):
     remarks = models.TextField(blank=True)
 
     created_at = models.DateTimeField(auto_now_add=True)
-    changed_at = models.DateTimeField(auto_now=True)
+    changed_at = models.DateTimeField(auto_now=True, db_index=True)
 
     _export_fields = OrderedDict([('arrival', 'arrival'),
                                   ('arrival_flight_number', 'arrival_flight_number'),
@@ -466,3 +672,99 @@ class TravelDetails(models.Model, ExportMixin):
 
     def __str__(self):
         return 'Travel Details for ' + self.participant.full_name()
+
+class ExportJob(models.Model):
+    KIND_CHOICES = [('RAW_CSV', 'Export to CSV'),
+                    ('RAW_XLSX', 'Export to XLSX'),
+                    ('REPORT', 'XLSX report'),
+                    ('REPORT_INVENTORY', 'XLSX report (inventory, no literature)'),
+                    ('EXHIBITS_CLASS', 'Exhibits in HTML (per class)'),
+                    ('EXHIBITS_JURY', 'Exhibits in HTML (per class, plus jury groups)'),
+                    ('EXHIBITS_INTRO', 'Exhibits in HTML (per class, plus jury groups and intro/synopsis)'),
+                    ('EXHIBITS_COUNTRY', 'Exhibits in HTML (per country)')]
+    STATUS_CHOICES = [('PENDING', 'Pending'),
+                      ('RUNNING', 'Running'),
+                      ('DONE', 'Done'),
+                      ('FAILED', 'Failed')]
+
+    class Meta:
+        verbose_name = 'Export Job'
+        verbose_name_plural = 'Export Jobs'
+
+    kind = models.CharField(max_length=32, choices=KIND_CHOICES)
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default='PENDING')
+    progress = models.IntegerField(default=0, help_text='Percent complete')
+    message = models.TextField(blank=True)
+    artifact = models.FileField(storage=ExportStorage(), blank=True)
+    media_url = models.CharField(max_length=256, blank=True, help_text='Absolute media URL for links in HTML exports')
+    requested_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, on_delete=models.SET_NULL, related_name='export_jobs')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    @classmethod
+    def claim(cls):
+        # Several workers may poll at once, so only the one that flips the status gets the job
+        for job in cls.objects.filter(status='PENDING').order_by('created_at')[:10]:
+            if cls.objects.filter(id=job.id, status='PENDING').update(status='RUNNING', started_at=timezone.now()):
+                job.refresh_from_db()
+                return job
+        return None
+
+    def set_progress(self, fraction):
+        progress = int(fraction * 100)
+        if progress != self.progress:
+            self.progress = progress
+            ExportJob.objects.filter(id=self.id).update(progress=progress)
+
+    def delete(self, *args, **kwargs):
+        if self.artifact:
+            self.artifact.delete(save=False)
+        return super().delete(*args, **kwargs)
+
+    def __str__(self):
+        return '%s (%s)' % (self.get_kind_display(), self.created_at)
+
+class OutgoingEmail(models.Model):
+    STATUS_CHOICES = [('PENDING', 'Pending'),
+                      ('SENT', 'Sent'),
+                      ('FAILED', 'Failed')]
+
+    class Meta:
+        verbose_name = 'Outgoing Email'
+        verbose_name_plural = 'Outgoing Emails'
+
+    subject = models.CharField(max_length=256)
+    message = models.TextField()
+    html_message = models.TextField(blank=True)
+    from_email = models.CharField(max_length=128)
+    recipients = models.TextField(help_text='Comma-separated list of addresses')
+    status = models.CharField(max_length=8, choices=STATUS_CHOICES, default='PENDING')
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    next_attempt_at = models.DateTimeField(default=timezone.now, db_index=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    def recipient_list(self):
+        return [address.strip() for address in self.recipients.split(',') if address.strip()]
+
+    def __str__(self):
+        return '%s (%s)' % (self.subject, self.recipients)
+
+class CommissionerDigestEntry(models.Model):
+    class Meta:
+        verbose_name = 'Commissioner Digest Entry'
+        verbose_name_plural = 'Commissioner Digest Entries'
+        unique_together = ('recipients', 'exhibit')
+
+    recipients = models.CharField(max_length=512, help_text='Comma-separated list of addresses')
+    exhibit = models.ForeignKey(Exhibit, on_delete=models.CASCADE, related_name='digest_entries')
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+    changed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '%s (%s)' % (self.exhibit, self.recipients)
@@ -0,0 +1,62 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Participant, Federation, Appointments, Exhibit, DeletedExhibit
+from .mail import clear_routing_table
+from .snapshot import SNAPSHOT_DATABASE
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    # The snapshot is only read, and replaced as a whole, so leave its journal mode alone
+    if connection.vendor != 'sqlite' or connection.alias == SNAPSHOT_DATABASE:
+        return
+    with connection.cursor() as cursor:
+        for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute('PRAGMA %s = %s' % (name, value))
+
+@receiver(post_delete, sender=Exhibit)
+def exhibit_deleted(sender, instance, **kwargs):
+    DeletedExhibit.objects.create(exhibit_id=instance.id)
+    Exhibit.collect_files(instance.file_names())
+
+@receiver(pre_save, sender=Exhibit)
+def exhibit_saving(sender, instance, **kwargs):
+    instance._previous_file_names = set()
+    if instance.pk:
+        for names in Exhibit.objects.filter(pk=instance.pk).values_list(*Exhibit.FILE_FIELDS):
+            instance._previous_file_names = {name for name in names if name}
+
+@receiver(post_save, sender=Exhibit)
+def exhibit_saved(sender, instance, **kwargs):
+    # Collect the files that were replaced
+    replaced = getattr(instance, '_previous_file_names', set()) - instance.file_names()
+    if replaced:
+        Exhibit.collect_files(replaced)
+
+@receiver(post_save, sender=Participant)
+@receiver(post_save, sender=Federation)
+@receiver(post_save, sender=Appointments)
+@receiver(post_delete, sender=Participant)
+@receiver(post_delete, sender=Federation)
+@receiver(post_delete, sender=Appointments)
+def routing_changed(sender, instance, **kwargs):
+    clear_routing_table()
@@ -0,0 +1,112 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import sqlite3
+import tempfile
+import threading
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+from django.utils import timezone
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+
+SNAPSHOT_DATABASE = 'snapshot'
+
+_state = threading.local()
+
+class SnapshotRouter():
+    # Sends reads to the snapshot inside export_snapshot() blocks, writes always go to the live database
+
+    def db_for_read(self, model, **hints):
+        if getattr(_state, 'active', False):
+            return SNAPSHOT_DATABASE
+        return None
+
+    def allow_migrate(self, db, app_label, **hints):
+        # The snapshot is a copy of the live database, including its schema
+        if db == SNAPSHOT_DATABASE:
+            return False
+        return None
+
+def snapshot_path():
+    return settings.DATABASES[SNAPSHOT_DATABASE]['NAME']
+
+def snapshot_taken_at():
+    # The modification time of the file is set to when the snapshot was taken
+    try:
+        return datetime.fromtimestamp(os.path.getmtime(snapshot_path()), timezone.utc)
+    except OSError:
+        return None
+
+def refresh_snapshot():
+    # Copy the live database with SQLite's online backup API, then swap the copy in place,
+    # so that connections to the previous snapshot keep reading it until they are closed
+    path = snapshot_path()
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    descriptor, temporary_path = tempfile.mkstemp(dir=directory, suffix='.sqlite3')
+    os.close(descriptor)
+
+    taken_at = timezone.now()
+    source = connections[DEFAULT_DB_ALIAS]
+    source.ensure_connection()
+    target = sqlite3.connect(temporary_path)
+    try:
+        source.connection.backup(target)
+        # No WAL files next to a file that gets replaced
+        target.execute('PRAGMA journal_mode = DELETE')
+    except Exception:
+        target.close()
+        os.remove(temporary_path)
+        raise
+    target.close()
+
+    # mkstemp() creates the file readable only by its owner
+    os.chmod(temporary_path, 0o644)
+    os.utime(temporary_path, (taken_at.timestamp(), taken_at.timestamp()))
+    os.replace(temporary_path, path)
+    return taken_at
+
+def refresh_stale_snapshot():
+    taken_at = snapshot_taken_at()
+    if taken_at is None or taken_at < timezone.now() - timedelta(seconds=settings.EXPORT_SNAPSHOT_INTERVAL):
+        return refresh_snapshot()
+    return None
+
+@contextmanager
+def export_snapshot():
+    # Reads in the block go to the snapshot, if exports are set to use one and it has been taken.
+    # Yields the time the snapshot was taken, or None if reading from the live database.
+    taken_at = snapshot_taken_at() if settings.EXPORT_FROM_SNAPSHOT else None
+    if taken_at is None or getattr(_state, 'active', False):
+        yield taken_at
+        return
+
+    # Reopen, as the file may have been replaced since the last export
+    connections[SNAPSHOT_DATABASE].close()
+    _state.active = True
+    try:
+        yield taken_at
+    finally:
+        _state.active = False
+
+def snapshot_stream(chunks):
+    # For streaming responses, which are generated after the view has returned
+    with export_snapshot():
+        yield from chunks
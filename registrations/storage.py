@@ -0,0 +1,135 @@
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+import os
+import re
+import time
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+from django.utils.functional import cached_property
+
+
+# Files (re)used this recently may be about to be referenced by a form still being saved
+COLLECT_GRACE_SECONDS = 10 * 60
+
+HASH_DIRECTORY = re.compile(r'[0-9a-f]{64}')
+
+
+@deconstructible
+class ExportStorage(FileSystemStorage):
+    # Generated exports are kept outside MEDIA_ROOT and only served to staff
+    def __init__(self):
+        super().__init__(base_url=None)
+
+    @cached_property
+    def base_location(self):
+        # Read when first used (not when the models are loaded), so that it follows the settings
+        return settings.EXPORT_ROOT
+
+    def _clear_cached_properties(self, setting, **kwargs):
+        super()._clear_cached_properties(setting, **kwargs)
+        if setting == 'EXPORT_ROOT':
+            self.__dict__.pop('base_location', None)
+            self.__dict__.pop('location', None)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    # Each distinct content is stored once, as <upload_to>/<sha256>/<filename>. Uploading the
+    # same content again under another filename links that name to the stored copy.
+
+    max_name_length = 255
+
+    def get_available_name(self, name, max_length=None):
+        # The name is only decided once the content has been hashed
+        return name
+
+    def _save(self, name, content):
+        directory, filename = os.path.split(name)
+        os.makedirs(self.path(directory), exist_ok=True)
+
+        digest = hashlib.sha256()
+        descriptor, temporary_path = tempfile.mkstemp(dir=self.path(directory), prefix='.upload-')
+        try:
+            with os.fdopen(descriptor, 'wb') as temporary_file:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    temporary_file.write(chunk)
+
+            blob_directory = os.path.join(directory, digest.hexdigest())
+
+            # Keep the name within the length of the model fields, preserving the extension
+            root, extension = os.path.splitext(filename)
+            excess = len(os.path.join(blob_directory, filename)) - self.max_name_length
+            if excess > 0:
+                filename = root[:max(len(root) - excess, 1)] + extension
+            name = os.path.join(blob_directory, filename)
+
+            existing = self.listdir(blob_directory)[1] if self.exists(blob_directory) else []
+            if filename in existing:
+                os.remove(temporary_path)
+            elif existing:
+                try:
+                    os.link(self.path(os.path.join(blob_directory, existing[0])), self.path(name))
+                    os.remove(temporary_path)
+                except OSError:
+                    # Without hard links (or if the other name was just collected), store a copy
+                    os.makedirs(self.path(blob_directory), exist_ok=True)
+                    os.replace(temporary_path, self.path(name))
+            else:
+                os.makedirs(self.path(blob_directory), exist_ok=True)
+                os.replace(temporary_path, self.path(name))
+            if existing:
+                # Keep it from being collected before the new reference is saved
+                os.utime(self.path(name))
+        except Exception:
+            if os.path.exists(temporary_path):
+                os.remove(temporary_path)
+            raise
+
+        if self.file_permissions_mode is not None:
+            os.chmod(self.path(name), self.file_permissions_mode)
+        return name.replace('\\', '/')
+
+    def delete(self, name):
+        super().delete(name)
+        # Remove the directory of the content too, if nothing else is in there
+        directory = os.path.dirname(self.path(name))
+        if not HASH_DIRECTORY.fullmatch(os.path.basename(directory)):
+            return
+        try:
+            os.rmdir(directory)
+        except OSError:
+            pass
+
+    def stored_names(self, directory):
+        if not self.exists(directory):
+            return
+        directories, files = self.listdir(directory)
+        for name in files:
+            yield os.path.join(directory, name).replace('\\', '/')
+        for name in directories:
+            yield from self.stored_names(os.path.join(directory, name))
+
+    def is_recent(self, name):
+        try:
+            return os.path.getmtime(self.path(name)) > time.time() - COLLECT_GRACE_SECONDS
+        except OSError:
+            return False
@@ -1,3 +1,1061 @@
-from django.test import TestCase
+# Copyright (C) 2019 Antony Chazapis
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; either version 2
+# of the License, or (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-# Create your tests here.
+import os
+import shutil
+import datetime
+import tempfile
+import unittest
+import unittest.mock
+import threading
+import io
+import time
+import csv
+import urllib.parse
+import zipfile
+import concurrent.futures
+import multiprocessing
+
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.db import connection, connections
+from django.db.utils import ConnectionHandler
+from django.utils import timezone
+from django.utils.http import http_date
+from django.utils.dateparse import parse_datetime
+from django.contrib.auth.models import User
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.urls import reverse
+from django.template.loader import render_to_string
+from django_countries import countries
+from collections import OrderedDict
+from django.http import FileResponse, StreamingHttpResponse
+from django.core import mail
+from django.core.management import call_command
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .models import Participant, Federation, Appointments, Exhibit, DeletedExhibit, ExhibitParticipation, TravelDetails, ExportJob, OutgoingEmail, CommissionerDigestEntry
+from .catalogue import CATALOGUE_FILES, publish_changed_catalogue
+from . import export
+from .export import run_export_task, run_export_job, remove_expired_export_jobs, report_participant_entries, report_exhibit_entries, render_exhibits, exhibit_sections, jury_media_members, stream_media_zip
+from .snapshot import SNAPSHOT_DATABASE, export_snapshot, refresh_snapshot
+from .images import PHOTO_MAX_SIZE, thumbnail_name
+from .mail import queue_mail, dispatch_emails, queue_exhibit_registration, queue_commissioner_digests, commissioner_recipients
+
+
+# Files written by the tests go to a directory of their own for every run
+TEST_ROOT = tempfile.mkdtemp(prefix='notos-tests-')
+TEST_MEDIA_ROOT = os.path.join(TEST_ROOT, 'media')
+TEST_EXPORT_ROOT = os.path.join(TEST_ROOT, 'exports')
+
+# Keep exports and cached pages out of the checkout for all tests
+module_settings = override_settings(EXPORT_ROOT=TEST_EXPORT_ROOT,
+                                    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                                        'LOCATION': 'notos-tests'}})
+
+
+def setUpModule():
+    module_settings.enable()
+
+def tearDownModule():
+    module_settings.disable()
+    shutil.rmtree(TEST_ROOT, ignore_errors=True)
+
+
+def create_participant(index, appointments=True, travel_details=True):
+    participant = Participant.objects.create(surname='Surname %d' % index,
+                                             name='Name %d' % index,
+                                             address='Street %d\nCity' % index,
+                                             country='GR',
+                                             email='participant%d@example.com' % index,
+                                             mobile='%010d' % index)
+    if appointments:
+        federation = Federation.objects.create(country='Greece',
+                                               country_code='GR',
+                                               name='Federation %d' % index,
+                                               email='federation%d@example.com' % index)
+        Appointments.objects.create(participant=participant,
+                                    federation=federation,
+                                    commissioner=bool(index % 2),
+                                    jury=True,
+                                    apprentice_jury=False,
+                                    team_leader=False)
+    if travel_details:
+        TravelDetails.objects.create(participant=participant,
+                                     arrival_flight_number='A3 %d' % index,
+                                     spouse=False,
+                                     remarks='Line 1\r\nLine 2')
+    return participant
+
+
+class FailingEmailBackend(BaseEmailBackend):
+    def send_messages(self, email_messages):
+        raise ConnectionError('Mail server unavailable')
+
+
+class DroppingEmailBackend(BaseEmailBackend):
+    # Drops the connection on the first message, and records the connections opened
+    opened = []
+    connected = False
+
+    def open(self):
+        if self.connected:
+            return False
+        self.opened.append(self)
+        self.connected = True
+        return True
+
+    def close(self):
+        self.connected = False
+
+    def send_messages(self, email_messages):
+        # Like the SMTP backend, use a connection of its own if not open
+        new_connection = self.open()
+        try:
+            if len(self.opened) == 1:
+                raise ConnectionError('Connection dropped')
+            mail.outbox.extend(email_messages)
+        finally:
+            if new_connection:
+                self.close()
+        return len(email_messages)
+
+
+class ExportTests(TestCase):
+    def test_export_layout(self):
+        create_participant(1)
+        create_participant(2, appointments=False)
+        create_participant(3, travel_details=False)
+
+        rows = list(Participant.export_rows())
+        self.assertEqual(rows[0], Participant.export_keys() + Appointments.export_keys() + TravelDetails.export_keys())
+        self.assertEqual(len(rows), 4)
+        for participant, values in zip(Participant.objects.order_by('pk'), rows[1:]):
+            appointments = participant.appointments.first() if participant.appointments.count() else Appointments()
+            travel_details = participant.travel_details.first() if participant.travel_details.count() else TravelDetails()
+            self.assertEqual(values, participant.export_values() + appointments.export_values() + travel_details.export_values())
+
+    def test_export_queries(self):
+        create_participant(1)
+        with self.assertNumQueries(3):
+            list(Participant.export_rows())
+
+        for index in range(2, 21):
+            create_participant(index, appointments=bool(index % 3), travel_details=bool(index % 4))
+        with self.assertNumQueries(3):
+            list(Participant.export_rows())
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_export_values(self):
+        participant = create_participant(1)
+        Exhibit.objects.create(participant=participant,
+                               title='Title',
+                               short_description='First line\r\nSecond line\n',
+                               exhibit_class='Y1',
+                               jury_group=2,
+                               date_of_birth=datetime.date(2008, 5, 1),
+                               frames=5,
+                               introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'),
+                               year_of_publication=0,
+                               received=True)
+
+        rows = list(Exhibit.export_rows())
+        self.assertEqual(rows[0], Exhibit.export_keys())
+        self.assertEqual(rows[1:], [exhibit.export_values() for exhibit in Exhibit.objects.order_by('pk')])
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_report_entries(self):
+        for index in range(1, 11):
+            participant = create_participant(index, appointments=bool(index % 3), travel_details=bool(index % 4))
+            Exhibit.objects.create(participant=participant,
+                                   title='Title %d' % index,
+                                   exhibit_class='L1' if index % 2 else 'C1',
+                                   frames=5,
+                                   introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+
+        with self.assertNumQueries(3):
+            entries = report_participant_entries()
+        for participant, entry in zip(Participant.objects.order_by('pk'), entries):
+            self.assertEqual(entry['participant'], participant.printout(all_fields=True))
+            appointments = participant.appointments.first()
+            self.assertEqual(entry['appointments'], appointments.printout(all_fields=True) if appointments else None)
+            travel_details = participant.travel_details.first()
+            self.assertEqual(entry['travel_details'], travel_details.printout(all_fields=True) if travel_details else None)
+
+        with self.assertNumQueries(1):
+            entries = report_exhibit_entries()
+        self.assertEqual([entry['participant'] for entry in entries],
+                         [exhibit.participant.printout(all_fields=True) for exhibit in Exhibit.objects.order_by('pk')])
+        self.assertEqual(entries[0]['participant']['Country'], 'Greece')
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_exhibits_queries(self):
+        exhibit_classes = [exhibit_class for exhibit_class, exhibit_class_title in Exhibit.EXHIBIT_CLASS_CHOICES]
+        for count in (1, 30):
+            for index in range(count):
+                participant = create_participant(index, appointments=False, travel_details=False)
+                participant.country = ('GR', 'CY', 'IT', 'FR')[index % 4]
+                participant.save()
+                Exhibit.objects.create(participant=participant,
+                                       title='Title %d' % index,
+                                       exhibit_class=exhibit_classes[index % len(exhibit_classes)],
+                                       jury_group=index % 3 or None,
+                                       frames=5,
+                                       # Exhibits from France are all rejected, so its section is left empty
+                                       rejected=index % 4 == 3,
+                                       introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+            for export_sort, extras in (('class', 0), ('class', 1), ('country', 0)):
+                with self.assertNumQueries(1):
+                    html = render_exhibits(export_sort, extras)
+                self.assertIn('Title %d' % (count - 1), html)
+            self.assertEqual(html, render_to_string('registrations/exhibits.html', {'exhibit_sections': self.country_sections(),
+                                                                                    'extras': 0,
+                                                                                    'media_url': ''}))
+        self.assertEqual(exhibit_sections('country')['France']['classes'], [])
+        self.assertNotIn('France', html)
+
+    def country_sections(self):
+        # The listing per country as it was built before, with a query per country and class
+        exhibit_countries = sorted(set(exhibit.participant.country.name for exhibit in Exhibit.objects.all()))
+        sections = OrderedDict()
+        for country in exhibit_countries:
+            exhibit_classes = []
+            for exhibit_class, exhibit_class_title in Exhibit.EXHIBIT_CLASS_CHOICES:
+                exhibits = Exhibit.objects.filter(exhibit_class=exhibit_class, participant__country=countries.by_name(country), rejected=False).order_by('participant__surname')
+                if len(exhibits) == 0:
+                    continue
+                exhibit_classes.append({'title': exhibit_class_title,
+                                        'exhibits': exhibits})
+            sections[country] = {'title': country,
+                                 'classes': exhibit_classes}
+        return sections
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_jury_media(self):
+        participant = create_participant(1, appointments=False, travel_details=False)
+        for index, (exhibit_class, jury_group, start_frame, rejected) in enumerate([('C1', 2, 12, False), ('A1', None, None, False), ('C1', 1, 1, True)]):
+            Exhibit.objects.create(participant=participant,
+                                   title='Exhibit title %d' % index,
+                                   exhibit_class=exhibit_class,
+                                   jury_group=jury_group,
+                                   start_frame=start_frame,
+                                   frames=5,
+                                   rejected=rejected,
+                                   introductory_page=SimpleUploadedFile('intro.pdf', b'%%PDF intro %d' % index),
+                                   synopsis=SimpleUploadedFile('synopsis.JPG', b'JPEG synopsis %d' % index))
+
+        with self.assertNumQueries(1):
+            members = jury_media_members()
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(stream_media_zip(members))))
+        self.assertEqual(archive.namelist(), ['A1/unassigned-Exhibit_title_1-intro.pdf',
+                                              'A1/unassigned-Exhibit_title_1-synopsis.jpg',
+                                              'C1/jury-group-2/012-Exhibit_title_0-intro.pdf',
+                                              'C1/jury-group-2/012-Exhibit_title_0-synopsis.jpg'])
+        self.assertTrue(all(info.compress_type == zipfile.ZIP_STORED for info in archive.infolist()))
+        self.assertEqual(archive.read('C1/jury-group-2/012-Exhibit_title_0-intro.pdf'), b'%PDF intro 0')
+
+    def test_export_csv_stream(self):
+        for index in range(1, 4):
+            create_participant(index, travel_details=bool(index % 2))
+        User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.client.login(username='staff', password='password')
+
+        response = self.client.get(reverse('export_raw') + '?type=csv')
+        self.assertIsInstance(response, StreamingHttpResponse)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn('attachment; filename="NOTOS-2021-export-', response['Content-Disposition'])
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIn('NOTOS-2021-export/federations.csv', archive.namelist())
+        rows = list(csv.reader(io.StringIO(archive.read('NOTOS-2021-export/registrants.csv').decode('utf-8'), newline='')))
+        self.assertEqual(rows, [[str(value) for value in values] for values in Participant.export_rows()])
+        self.assertEqual(rows[1][2], 'Surname 1')
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_incremental_export(self):
+        participants = [create_participant(index) for index in range(1, 4)]
+        exhibits = [Exhibit.objects.create(participant=participant, title='Title %d' % index, short_description='Description', exhibit_class='C1', frames=5,
+                                           introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+                    for index, participant in enumerate(participants[:2])]
+        participation = ExhibitParticipation.objects.create(exhibit=exhibits[0], exhibition_level='NAT', exhibition_name='Exhibition', points=80,
+                                                            special_prize=False, felicitations=False)
+        User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        cursor = self.client.get(reverse('export_raw') + '?type=csv')['X-Export-Cursor']
+
+        # Registrants follow their appointments and travel details, participations their exhibit
+        appointments = participants[0].appointments.first()
+        appointments.jury = False
+        appointments.save()
+        travel_details = participants[1].travel_details.first()
+        travel_details.spouse = True
+        travel_details.save()
+        exhibits[0].title = 'Changed title'
+        exhibits[0].save()
+        deleted_id = exhibits[1].id
+        exhibits[1].delete()
+
+        since = parse_datetime(cursor)
+        self.assertEqual(set(Participant.export_queryset(since)), set(participants[:2]))
+        self.assertEqual(list(Exhibit.export_queryset(since)), exhibits[:1])
+        self.assertEqual(list(ExhibitParticipation.export_queryset(since)), [participation])
+        self.assertEqual(list(DeletedExhibit.export_queryset(since).values_list('exhibit_id', flat=True)), [deleted_id])
+
+        response = self.client.get(reverse('export_raw'), {'type': 'csv', 'since': cursor})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+        def rows(table):
+            return list(csv.reader(io.StringIO(archive.read('NOTOS-2021-export/%s.csv' % table).decode('utf-8'), newline='')))[1:]
+        self.assertEqual([row[0] for row in rows('registrants')], [str(participant.id) for participant in participants[:2]])
+        self.assertEqual([row[0] for row in rows('exhibits')], [str(exhibits[0].id)])
+        self.assertEqual([row[0] for row in rows('deleted_exhibits')], [str(deleted_id)])
+
+        # The returned cursor picks up from there
+        response = self.client.get(reverse('export_raw'), {'type': 'csv', 'since': response['X-Export-Cursor']})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(rows('registrants'), [])
+        self.assertEqual(rows('deleted_exhibits'), [])
+
+        self.assertEqual(self.client.get(reverse('export_raw'), {'type': 'csv', 'since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('export_raw'), {'type': 'csv', 'since': '2020-13-45T00:00:00'}).status_code, 400)
+
+    def test_export_xlsx_spool(self):
+        for index in range(1, 4):
+            create_participant(index)
+
+        # Kept in memory, and rolled over to disk once larger than the spool size
+        for spool_size in (export.XLSX_SPOOL_SIZE, 1):
+            with unittest.mock.patch.object(export, 'XLSX_SPOOL_SIZE', spool_size):
+                response = export.xlsx_response(export.write_raw_xlsx, 'export.xlsx')
+            self.assertIsInstance(response, FileResponse)
+            self.assertIn('filename="export.xlsx"', response['Content-Disposition'])
+            self.assertEqual(response.file_to_stream._rolled, spool_size == 1)
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+            response.close()
+            self.assertIn('name="registrants"', archive.read('xl/workbook.xml').decode('utf-8'))
+            self.assertIn(b'Surname 3', b''.join(archive.read(name) for name in archive.namelist()))
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_export_cache(self):
+        participant = create_participant(1)
+        exhibit = Exhibit.objects.create(participant=participant, title='Title', short_description='Description', exhibit_class='C1', frames=5,
+                                         introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+        User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        url = reverse('export_raw') + '?type=csv'
+
+        def download():
+            response = self.client.get(url)
+            content = b''.join(response.streaming_content)
+            response.close()
+            return isinstance(response, FileResponse), content
+
+        # Written while streamed, then served from the cache as long as nothing changes
+        cached, content = download()
+        self.assertFalse(cached)
+        self.assertEqual(download(), (True, content))
+        self.assertIn('NOTOS-2021-export/exhibits.csv', zipfile.ZipFile(io.BytesIO(content)).namelist())
+
+        participant.surname = 'Changed'
+        participant.save()
+        cached, changed_content = download()
+        self.assertFalse(cached)
+        self.assertIn(b'Changed', zipfile.ZipFile(io.BytesIO(changed_content)).read('NOTOS-2021-export/registrants.csv'))
+        self.assertTrue(download()[0])
+
+        exhibit.delete()
+        cached, deleted_content = download()
+        self.assertFalse(cached)
+        self.assertNotIn(b'Title', zipfile.ZipFile(io.BytesIO(deleted_content)).read('NOTOS-2021-export/exhibits.csv'))
+
+        # Only the artifact of the current version is kept
+        self.assertEqual(len([name for name in os.listdir(os.path.join(TEST_EXPORT_ROOT, 'cache')) if name.startswith('raw-')]), 1)
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_export_command(self):
+        participant = create_participant(1)
+        Exhibit.objects.create(participant=participant, title='Title', short_description='Description', exhibit_class='C1', frames=5,
+                               introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+        directory = os.path.join(TEST_ROOT, 'command')
+
+        # Worker processes would not see the test database, so run the tasks in this one
+        class InlineExecutor(concurrent.futures.Executor):
+            def __init__(self, max_workers=None, initializer=None):
+                pass
+
+            def submit(self, function, *args):
+                future = concurrent.futures.Future()
+                future.set_result(function(*args))
+                return future
+
+        with unittest.mock.patch('registrations.management.commands.export.ProcessPoolExecutor', InlineExecutor):
+            call_command('export', directory, processes=1, stdout=io.StringIO())
+
+        # The name of the bundle is timestamped
+        bundles = [filename for filename in os.listdir(directory) if filename.endswith('.zip')]
+        self.assertEqual(len(bundles), 1)
+        self.assertTrue(bundles[0].startswith('NOTOS-2021-export-'))
+        self.assertEqual(sorted(set(os.listdir(directory)) - set(bundles)), sorted(export.EXPORT_COMMAND_FILES.values()))
+        for filename in export.EXPORT_COMMAND_FILES.values():
+            self.assertGreater(os.path.getsize(os.path.join(directory, filename)), 0)
+        self.assertIn(b'Title', open(os.path.join(directory, 'exhibits-class.html'), 'rb').read())
+        archive = zipfile.ZipFile(os.path.join(directory, bundles[0]))
+        self.assertEqual(sorted(archive.namelist()), sorted('NOTOS-2021-export/%s.csv' % table for table, rows in export.raw_tables()))
+        self.assertIn(b'Surname 1', archive.read('NOTOS-2021-export/registrants.csv'))
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite' and multiprocessing.get_start_method() == 'fork', 'Worker processes inherit the database settings when forked')
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ExportProcessTests(SimpleTestCase):
+    # The test database lives in memory, where worker processes would not see it, so use a file
+    databases = {'default'}
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp(dir=TEST_ROOT)
+        self.addCleanup(shutil.rmtree, self.directory)
+        test_connection = connections['default']
+        settings_dict = dict(test_connection.settings_dict, NAME=os.path.join(self.directory, 'db.sqlite3'))
+        connections['default'] = test_connection.__class__(settings_dict, 'default')
+        self.addCleanup(connections.__setitem__, 'default', test_connection)
+        self.addCleanup(connections['default'].close)
+        call_command('migrate', verbosity=0)
+
+    def test_export_command(self):
+        for index in range(1, 4):
+            participant = create_participant(index)
+            Exhibit.objects.create(participant=participant, title='Title %d' % index, short_description='Description', exhibit_class='C1', frames=5,
+                                   introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+        directory = os.path.join(self.directory, 'export')
+
+        call_command('export', directory, processes=2, stdout=io.StringIO())
+
+        self.assertEqual(len(os.listdir(directory)), len(export.EXPORT_COMMAND_FILES) + 1)
+        self.assertIn(b'Title 3', open(os.path.join(directory, 'exhibits-country.html'), 'rb').read())
+        archive = zipfile.ZipFile(os.path.join(directory, [filename for filename in os.listdir(directory) if filename.endswith('.zip')][0]))
+        self.assertEqual(sorted(archive.namelist()), sorted('NOTOS-2021-export/%s.csv' % table for table, rows in export.raw_tables()))
+        rows = list(csv.reader(io.StringIO(archive.read('NOTOS-2021-export/registrants.csv').decode('utf-8'), newline='')))
+        self.assertEqual([row[2] for row in rows[1:]], ['Surname 1', 'Surname 2', 'Surname 3'])
+
+
+class ExportJobTests(TestCase):
+    def test_claim(self):
+        jobs = [ExportJob.objects.create(kind='EXHIBITS_CLASS') for index in range(2)]
+        ExportJob.objects.create(kind='EXHIBITS_CLASS', status='DONE')
+
+        for job in jobs:
+            claimed = ExportJob.claim()
+            self.assertEqual(claimed.id, job.id)
+            self.assertEqual(claimed.status, 'RUNNING')
+            self.assertIsNotNone(claimed.started_at)
+        self.assertIsNone(ExportJob.claim())
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_run_and_download(self):
+        participant = create_participant(1, appointments=False, travel_details=False)
+        Exhibit.objects.create(participant=participant, title='Title', short_description='Description', exhibit_class='C1', frames=5,
+                               introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+        ExportJob.objects.create(kind='EXHIBITS_CLASS')
+        job = ExportJob.claim()
+        run_export_job(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), ('DONE', 100))
+        self.assertIsNotNone(job.finished_at)
+        self.assertTrue(job.artifact.path.startswith(TEST_EXPORT_ROOT))
+
+        User.objects.create_user('staff', 'staff@example.com', 'password', is_staff=True)
+        self.client.login(username='staff', password='password')
+        response = self.client.get(reverse('export_job_download', kwargs={'job_id': job.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'Title', b''.join(response.streaming_content))
+        response.close()
+
+        pending = ExportJob.objects.create(kind='EXHIBITS_CLASS')
+        self.assertEqual(self.client.get(reverse('export_job_download', kwargs={'job_id': pending.id})).status_code, 404)
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, EXPORT_JOB_RETENTION_DAYS=7)
+    def test_remove_expired(self):
+        ExportJob.objects.create(kind='EXHIBITS_CLASS')
+        run_export_job(ExportJob.claim())
+        expired = ExportJob.objects.get()
+        running = ExportJob.objects.create(kind='EXHIBITS_CLASS', status='RUNNING')
+        recent = ExportJob.objects.create(kind='EXHIBITS_CLASS', status='DONE')
+        ExportJob.objects.filter(id__in=[expired.id, running.id]).update(created_at=timezone.now() - datetime.timedelta(days=8))
+
+        remove_expired_export_jobs()
+        self.assertEqual(set(ExportJob.objects.values_list('id', flat=True)), set([running.id, recent.id]))
+        self.assertFalse(os.path.exists(expired.artifact.path))
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, EXPORT_JOB_TIMEOUT=3600)
+    def test_fail_stale(self):
+        stale = ExportJob.objects.create(kind='EXHIBITS_CLASS', status='RUNNING', started_at=timezone.now() - datetime.timedelta(hours=2))
+        running = ExportJob.objects.create(kind='EXHIBITS_CLASS', status='RUNNING', started_at=timezone.now())
+
+        # Picked up by the worker on its next poll
+        call_command('export_worker', once=True, stdout=io.StringIO())
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, 'FAILED')
+        self.assertIsNotNone(stale.finished_at)
+        self.assertEqual(running.status, 'RUNNING')
+
+        # And then expires as any other finished job
+        ExportJob.objects.filter(id=stale.id).update(created_at=timezone.now() - datetime.timedelta(days=8))
+        remove_expired_export_jobs()
+        self.assertFalse(ExportJob.objects.filter(id=stale.id).exists())
+
+
+class RegistrationTests(TestCase):
+    def test_register_queries(self):
+        user = User.objects.create_user('participant', 'participant@example.com', 'password')
+        participant = create_participant(1)
+        participant.user = user
+        participant.save()
+        self.client.login(username='participant', password='password')
+
+        # Session, user and participant state, plus the form instance/choices of each step
+        for step, queries in (('personal', 3), ('appointments', 5), ('exhibit', 4), ('travel', 4)):
+            with self.assertNumQueries(queries):
+                response = self.client.get(reverse('register', kwargs={'step': step}))
+            self.assertEqual(response.status_code, 200)
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_media_access(self):
+        users = [User.objects.create_user('participant%d' % index, 'participant%d@example.com' % index, 'password') for index in range(2)]
+        participant = create_participant(1, appointments=False, travel_details=False)
+        participant.user = users[0]
+        participant.save()
+        exhibit = Exhibit.objects.create(participant=participant, title='Title', short_description='Description', exhibit_class='C1', frames=5,
+                                         introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF media'))
+        url = settings.MEDIA_URL + exhibit.introductory_page.name
+
+        self.assertEqual(self.client.get(url).status_code, 302)
+        self.client.login(username='participant1', password='password')
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(settings.MEDIA_URL + '../db.sqlite3').status_code, 404)
+
+        self.client.login(username='participant0', password='password')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'%PDF media')
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+
+        # The web server sends the file, once access is checked
+        with self.settings(MEDIA_SENDFILE='X-Sendfile'):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Sendfile'], os.path.join(TEST_MEDIA_ROOT, exhibit.introductory_page.name))
+        self.assertEqual(response.content, b'')
+
+        # Names of uploads are kept, in whatever script they are written
+        exhibit.introductory_page = SimpleUploadedFile('Εισαγωγή.pdf', b'%PDF greek')
+        exhibit.save()
+        name = exhibit.introductory_page.name
+        self.assertTrue(name.endswith('/Εισαγωγή.pdf'))
+        url = settings.MEDIA_URL + urllib.parse.quote(name)
+        with self.settings(MEDIA_SENDFILE='X-Sendfile'):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.serialize_headers().split(b'X-Sendfile: ')[1].split(b'\r\n')[0],
+                         os.path.join(TEST_MEDIA_ROOT, name).encode('utf-8'))
+        with self.settings(MEDIA_SENDFILE='X-Accel-Redirect', MEDIA_ACCEL_REDIRECT_PREFIX='/protected-media/'):
+            response = self.client.get(url)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/' + urllib.parse.quote(name))
+        self.assertEqual(urllib.parse.unquote(response['X-Accel-Redirect']), '/protected-media/' + name)
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+    def test_conditional_get(self):
+        user = User.objects.create_user('participant', 'participant@example.com', 'password', is_staff=True)
+        participant = create_participant(1)
+        participant.user = user
+        participant.save()
+        exhibit = Exhibit.objects.create(participant=participant, title='Title', short_description='Description', exhibit_class='C1', frames=5,
+                                         introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+        participation = ExhibitParticipation.objects.create(exhibit=exhibit, exhibition_level='NAT', exhibition_name='Exhibition', points=80, medal='G',
+                                                            special_prize=False, felicitations=False)
+        self.client.login(username='participant', password='password')
+
+        for url in (reverse('print'), reverse('export_exhibits') + '?extras=1'):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('no-cache', response['Cache-Control'])
+
+            # Session, user and the aggregate query
+            with self.assertNumQueries(3):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+        # Removing a row changes the printout too
+        etag = self.client.get(reverse('print'))['ETag']
+        participation.delete()
+        self.assertEqual(self.client.get(reverse('print'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        etag = self.client.get(reverse('export_exhibits'))['ETag']
+        Exhibit.objects.filter(pk=exhibit.pk).update(title='New title', changed_at=timezone.now())
+        response = self.client.get(reverse('export_exhibits'), HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'New title')
+
+        # Dates cannot tell that rows were removed, so If-Modified-Since is not honoured
+        since = http_date(time.time() + 3600)
+        self.assertEqual(self.client.get(reverse('export_exhibits'), HTTP_IF_MODIFIED_SINCE=since).status_code, 200)
+        exhibit.delete()
+        for url in (reverse('print'), reverse('export_exhibits')):
+            response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=since)
+            self.assertNotIn('Last-Modified', response)
+            self.assertNotContains(response, 'New title')
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_printout_queries(self):
+        user = User.objects.create_user('participant', 'participant@example.com', 'password')
+        participant = create_participant(1)
+        participant.user = user
+        participant.save()
+        for index in range(3):
+            exhibit = Exhibit.objects.create(participant=participant, title='Title %d' % index, short_description='Description', exhibit_class='C1', frames=5,
+                                             introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+            for points in range(index):
+                ExhibitParticipation.objects.create(exhibit=exhibit, exhibition_level='NAT', exhibition_name='Exhibition %d' % points, points=points,
+                                                    special_prize=False, felicitations=False)
+        self.client.login(username='participant', password='password')
+
+        # Session, user, the aggregate query and one per prefetched relation, then only the first three
+        with self.assertNumQueries(8):
+            response = self.client.get(reverse('print'))
+        self.assertContains(response, 'Previous participation #2')
+        self.assertContains(response, 'Exhibition 1')
+        self.assertContains(response, 'Federation 1')
+        generated_at = datetime.datetime(2021, 1, 1, 12, 0, tzinfo=datetime.timezone.utc)
+        with self.assertNumQueries(3), unittest.mock.patch('django.template.defaulttags.datetime') as clock:
+            clock.now.return_value = generated_at
+            cached = self.client.get(reverse('print')).content.decode('utf-8')
+        # Only the registration data is cached, the time it was generated is always current
+        self.assertEqual(cached.split('<footer')[0], response.content.decode('utf-8').split('<footer')[0])
+        self.assertIn('Generated at Fri, 1 Jan 2021', cached)
+
+        exhibit.delete()
+        self.assertNotContains(self.client.get(reverse('print')), 'Title 2')
+
+class MailTests(TestCase):
+    def test_dispatch(self):
+        for index in range(3):
+            queue_mail('Subject %d' % index, 'Text', 'noreply@example.com', ['a@example.com', 'b@example.com'], html_message='<p>HTML</p>')
+        self.assertEqual(len(mail.outbox), 0)
+
+        self.assertEqual(dispatch_emails(batch_size=2), 3)
+        self.assertEqual([message.subject for message in mail.outbox], ['Subject 0', 'Subject 1', 'Subject 2'])
+        self.assertEqual(mail.outbox[0].to, ['a@example.com', 'b@example.com'])
+        self.assertEqual(mail.outbox[0].alternatives, [('<p>HTML</p>', 'text/html')])
+        self.assertFalse(OutgoingEmail.objects.exclude(status='SENT').exists())
+        self.assertEqual(dispatch_emails(), 0)
+
+    @override_settings(EMAIL_BACKEND='registrations.tests.FailingEmailBackend', EMAIL_RETRY_DELAY=60, EMAIL_MAX_ATTEMPTS=2)
+    def test_retry(self):
+        email = queue_mail('Subject', 'Text', 'noreply@example.com', ['a@example.com'])
+
+        self.assertEqual(dispatch_emails(), 0)
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('PENDING', 1))
+        self.assertIn('Mail server unavailable', email.last_error)
+        self.assertGreater(email.next_attempt_at, timezone.now() + datetime.timedelta(seconds=50))
+
+        # Not due yet
+        self.assertEqual(dispatch_emails(), 0)
+        email.refresh_from_db()
+        self.assertEqual(email.attempts, 1)
+
+        OutgoingEmail.objects.update(next_attempt_at=timezone.now())
+        dispatch_emails()
+        email.refresh_from_db()
+        self.assertEqual((email.status, email.attempts), ('FAILED', 2))
+
+    @override_settings(EMAIL_BACKEND='registrations.tests.DroppingEmailBackend')
+    def test_reconnect(self):
+        DroppingEmailBackend.opened = []
+        for index in range(4):
+            queue_mail('Subject %d' % index, 'Text', 'noreply@example.com', ['a@example.com'])
+
+        # Reconnected once after the failure, the rest share the new connection
+        self.assertEqual(dispatch_emails(), 3)
+        self.assertEqual(len(DroppingEmailBackend.opened), 2)
+        self.assertEqual([message.subject for message in mail.outbox], ['Subject 1', 'Subject 2', 'Subject 3'])
+        self.assertEqual(OutgoingEmail.objects.get(subject='Subject 0').status, 'PENDING')
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, COMMISSIONER_DIGEST_INTERVAL=3600)
+    def test_commissioner_digest(self):
+        exhibits = []
+        for index in range(3):
+            participant = create_participant(index, appointments=False, travel_details=False)
+            exhibits.append(Exhibit.objects.create(participant=participant,
+                                                   title='Title %d' % index,
+                                                   exhibit_class='C1',
+                                                   frames=5,
+                                                   introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF')))
+        for exhibit in exhibits + exhibits[:1]:
+            queue_exhibit_registration(['commissioner@example.com'], exhibit)
+        queue_exhibit_registration(['other@example.com'], exhibits[2])
+
+        # Nothing is due before the interval passes
+        queue_commissioner_digests()
+        self.assertFalse(OutgoingEmail.objects.exists())
+
+        exhibits[0].title = 'Corrected title'
+        exhibits[0].save()
+        with self.settings(COMMISSIONER_DIGEST_INTERVAL=0):
+            queue_commissioner_digests()
+        emails = {email.recipients: email for email in OutgoingEmail.objects.all()}
+        self.assertEqual(set(emails.keys()), set(['commissioner@example.com', 'other@example.com']))
+        html_message = emails['commissioner@example.com'].html_message
+        self.assertIn('Corrected title', html_message)
+        self.assertNotIn('Title 0', html_message)
+        self.assertEqual(html_message.count('Title 1'), 1)
+        self.assertNotIn('Title 1', emails['other@example.com'].html_message)
+
+    @override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, COMMISSIONER_DIGEST_INTERVAL=3600)
+    def test_commissioner_digest_changed_while_sent(self):
+        participant = create_participant(1, appointments=False, travel_details=False)
+        exhibit = Exhibit.objects.create(participant=participant, title='Title', exhibit_class='C1', frames=5,
+                                         introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+        queue_exhibit_registration(['commissioner@example.com'], exhibit)
+
+        # The exhibit is saved again after its entry is read for the digest
+        def render_and_change(*args, **kwargs):
+            content = render_to_string(*args, **kwargs)
+            if exhibit.title == 'Title':
+                exhibit.title = 'Corrected title'
+                exhibit.save()
+                queue_exhibit_registration(['commissioner@example.com'], exhibit)
+            return content
+
+        CommissionerDigestEntry.objects.update(created_at=timezone.now() - datetime.timedelta(hours=2))
+        with unittest.mock.patch('registrations.mail.render_to_string', render_and_change):
+            queue_commissioner_digests()
+        self.assertEqual(OutgoingEmail.objects.count(), 1)
+        self.assertEqual(CommissionerDigestEntry.objects.count(), 1)
+        queue_commissioner_digests()
+        self.assertIn('Corrected title', OutgoingEmail.objects.order_by('id').last().html_message)
+        self.assertFalse(CommissionerDigestEntry.objects.exists())
+
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}, NO_COMMISSIONER_EMAIL='fallback@example.com')
+    def test_commissioner_recipients(self):
+        federation = Federation.objects.create(country='Cyprus',
+                                               country_code='CY',
+                                               name='Federation',
+                                               email='president@example.com, secretary@example.com')
+        with self.assertNumQueries(1):
+            self.assertEqual(commissioner_recipients('CY'), ['president@example.com', 'secretary@example.com'])
+            self.assertEqual(commissioner_recipients('IT'), ['fallback@example.com'])
+        with self.assertNumQueries(0):
+            self.assertEqual(commissioner_recipients('CY'), ['president@example.com', 'secretary@example.com'])
+
+        federation.commissioner_email = 'commissioner@example.com'
+        federation.save()
+        self.assertEqual(commissioner_recipients('CY'), ['commissioner@example.com'])
+
+        participant = create_participant(1, appointments=False, travel_details=False)
+        appointments = Appointments.objects.create(participant=participant,
+                                                   federation=federation,
+                                                   commissioner=True,
+                                                   jury=False,
+                                                   apprentice_jury=False,
+                                                   team_leader=False)
+        self.assertEqual(commissioner_recipients('CY'), ['participant1@example.com'])
+
+        participant.email = 'changed@example.com'
+        participant.save()
+        self.assertEqual(commissioner_recipients('CY'), ['changed@example.com'])
+
+        appointments.delete()
+        self.assertEqual(commissioner_recipients('CY'), ['commissioner@example.com'])
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'EXPLAIN QUERY PLAN is specific to SQLite')
+class IndexTests(TestCase):
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertUsesIndex(self, queryset, table):
+        plan = self.query_plan(queryset)
+        steps = [step for step in plan if (' %s ' % table) in (step + ' ')]
+        self.assertTrue(steps, plan)
+        for step in steps:
+            self.assertIn('USING', step, plan)
+
+    def test_query_plans(self):
+        since = timezone.now()
+        self.assertUsesIndex(Participant.objects.filter(user_id=1), 'registrations_participant')
+        self.assertUsesIndex(Participant.objects.filter(changed_at__gt=since), 'registrations_participant')
+        self.assertUsesIndex(Federation.objects.filter(country_code='GR'), 'registrations_federation')
+        self.assertUsesIndex(Appointments.objects.filter(commissioner=True, federation__country_code='GR'), 'registrations_appointments')
+        self.assertUsesIndex(Appointments.objects.filter(changed_at__gt=since), 'registrations_appointments')
+        self.assertUsesIndex(Exhibit.objects.filter(rejected=False).order_by('start_frame'), 'registrations_exhibit')
+        self.assertUsesIndex(Exhibit.objects.filter(exhibit_class='C1', rejected=False).order_by('start_frame'), 'registrations_exhibit')
+        self.assertUsesIndex(Exhibit.objects.filter(exhibit_class='C1').order_by('-pk'), 'registrations_exhibit')
+        self.assertUsesIndex(Exhibit.objects.filter(changed_at__gt=since), 'registrations_exhibit')
+        self.assertUsesIndex(TravelDetails.objects.filter(changed_at__gt=since), 'registrations_traveldetails')
+
+
+@unittest.skipUnless(connection.vendor == 'sqlite', 'Tests the SQLite connection profile')
+class SQLiteTests(SimpleTestCase):
+    def setUp(self):
+        # The test database lives in memory, so use a file to exercise locking
+        self.directory = tempfile.TemporaryDirectory()
+        self.connections = ConnectionHandler({'default': {'ENGINE': 'django.db.backends.sqlite3',
+                                                          'NAME': os.path.join(self.directory.name, 'stress.sqlite3')}})
+
+    def tearDown(self):
+        self.connections.close_all()
+        self.directory.cleanup()
+
+    def test_pragmas(self):
+        with self.connections['default'].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 20000)
+
+    def test_concurrent_writers(self):
+        with self.connections['default'].cursor() as cursor:
+            cursor.execute('CREATE TABLE entry (id INTEGER PRIMARY KEY, writer INTEGER, number INTEGER, value TEXT)')
+        self.connections['default'].close()
+
+        writers = 8
+        rows = 50
+        errors = []
+        reading = threading.Event()
+        written = threading.Event()
+
+        def write(writer):
+            # Each row is numbered after the ones before it, so read and write in one transaction
+            connection = self.connections['default']
+            try:
+                for index in range(rows):
+                    with connection.cursor() as cursor:
+                        cursor.execute('BEGIN IMMEDIATE')
+                        try:
+                            cursor.execute('SELECT COUNT(*) FROM entry WHERE writer = %s', [writer])
+                            number = cursor.fetchone()[0]
+                            cursor.execute('INSERT INTO entry (writer, number, value) VALUES (%s, %s, %s)', [writer, number, 'x' * 1024])
+                            cursor.execute('COMMIT')
+                        except Exception:
+                            cursor.execute('ROLLBACK')
+                            raise
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        def read():
+            # A long read (such as an export) that holds its transaction while the writers commit.
+            # Without WAL, the writers could not commit until it ends, and would time out.
+            connection = self.connections['default']
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('BEGIN')
+                    cursor.execute('SELECT COUNT(*) FROM entry')
+                    counts = [cursor.fetchone()[0]]
+                    reading.set()
+                    written.wait(60)
+                    cursor.execute('SELECT COUNT(*) FROM entry')
+                    counts.append(cursor.fetchone()[0])
+                    cursor.execute('COMMIT')
+                # It kept reading the data as it was when it started
+                if counts != [0, 0]:
+                    errors.append(AssertionError('Read %s' % counts))
+            except Exception as e:
+                errors.append(e)
+            finally:
+                reading.set()
+                connection.close()
+
+        reader = threading.Thread(target=read)
+        reader.start()
+        reading.wait(60)
+        threads = [threading.Thread(target=write, args=(writer,)) for writer in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        written.set()
+        reader.join()
+
+        self.assertEqual(errors, [])
+        with self.connections['default'].cursor() as cursor:
+            cursor.execute('SELECT COUNT(*), COUNT(DISTINCT writer || \'-\' || number) FROM entry')
+            self.assertEqual(cursor.fetchone(), (writers * rows, writers * rows))
+
+
+@override_settings(EXPORT_FROM_SNAPSHOT=True)
+class SnapshotTests(TransactionTestCase):
+    # The snapshot is a copy of committed data, so do not run in a transaction
+    databases = {'default', 'snapshot'}
+
+    def setUp(self):
+        # Take the snapshot in a file of its own, instead of the test database of the alias
+        directory = tempfile.mkdtemp(dir=TEST_ROOT)
+        self.path = os.path.join(directory, 'snapshot.sqlite3')
+        connections[SNAPSHOT_DATABASE].close()
+        name = settings.DATABASES[SNAPSHOT_DATABASE]['NAME']
+        settings.DATABASES[SNAPSHOT_DATABASE]['NAME'] = connections[SNAPSHOT_DATABASE].settings_dict['NAME'] = self.path
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(settings.DATABASES[SNAPSHOT_DATABASE].__setitem__, 'NAME', name)
+        self.addCleanup(connections[SNAPSHOT_DATABASE].settings_dict.__setitem__, 'NAME', name)
+        self.addCleanup(connections[SNAPSHOT_DATABASE].close)
+
+    def registrants(self, directory):
+        path = os.path.join(directory, 'registrants.csv')
+        run_export_task('registrants', path)
+        with open(path, encoding='utf-8', newline='') as stream:
+            return [row[2] for row in list(csv.reader(stream))[1:]]
+
+    def test_snapshot(self):
+        create_participant(1)
+        with export_snapshot() as taken_at:
+            self.assertIsNone(taken_at)
+        self.assertIsNotNone(refresh_snapshot())
+        create_participant(2)
+
+        # Exports read from the snapshot, everything else from the live database
+        with export_snapshot() as taken_at:
+            self.assertIsNotNone(taken_at)
+            self.assertEqual(Participant.objects.all().db, SNAPSHOT_DATABASE)
+            self.assertEqual(Participant.objects.count(), 1)
+        self.assertEqual(Participant.objects.count(), 2)
+        directory = os.path.dirname(self.path)
+        self.assertEqual(self.registrants(directory), ['Surname 1'])
+
+        # The snapshot is replaced as a whole
+        inode = os.stat(self.path).st_ino
+        refresh_snapshot()
+        self.assertNotEqual(os.stat(self.path).st_ino, inode)
+        self.assertEqual(self.registrants(directory), ['Surname 1', 'Surname 2'])
+        self.assertEqual(sorted(os.listdir(directory)), ['registrants.csv', 'snapshot.sqlite3'])
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class PhotoTests(TestCase):
+    def test_photo_processing(self):
+        # A landscape picture taken with the camera turned, as phones store it
+        from PIL import Image
+        image = Image.new('RGB', (3000, 1500), 'red')
+        exif = image.getexif()
+        exif[0x0112] = 6
+        stream = io.BytesIO()
+        image.save(stream, 'JPEG', exif=exif.tobytes())
+
+        participant = create_participant(1, appointments=False, travel_details=False)
+        participant.photo = SimpleUploadedFile('photo.jpeg', stream.getvalue())
+        participant.save()
+
+        self.assertTrue(participant.photo.name.endswith('.jpg'))
+        with Image.open(participant.photo.path) as photo:
+            self.assertEqual(photo.size, (PHOTO_MAX_SIZE[1] // 2, PHOTO_MAX_SIZE[1]))
+            self.assertNotIn('exif', photo.info)
+        for size in ('small', 'medium'):
+            self.assertTrue(participant.photo.storage.exists(thumbnail_name(participant.photo.name, size)))
+        self.assertTrue(participant.photo_thumbnail_url().startswith('/media/participant/thumbnails/small/'))
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT)
+class ExhibitFileTests(TestCase):
+    def backdate(self, storage, name):
+        os.utime(storage.path(name), (0, 0))
+
+    def test_deduplication(self):
+        participant = create_participant(1, appointments=False, travel_details=False)
+        exhibits = [Exhibit.objects.create(participant=participant, title='Exhibit %d' % i, short_description='Description',
+                                           exhibit_class='TP', frames=5,
+                                           introductory_page=SimpleUploadedFile('intro-%d.pdf' % i, b'%PDF shared'))
+                    for i in range(2)]
+        storage = exhibits[0].introductory_page.storage
+        shared_name = exhibits[0].introductory_page.name
+        other_name = exhibits[1].introductory_page.name
+
+        # The same content is stored once, under the filename of each upload
+        self.assertEqual(os.path.dirname(other_name), os.path.dirname(shared_name))
+        self.assertEqual(sorted(storage.listdir(os.path.dirname(shared_name))[1]), ['intro-0.pdf', 'intro-1.pdf'])
+        self.assertTrue(os.path.samefile(storage.path(shared_name), storage.path(other_name)))
+
+        # Replacing the file deletes its name, the content stays for the other exhibit
+        self.backdate(storage, shared_name)
+        exhibits[0].introductory_page = SimpleUploadedFile('intro.pdf', b'%PDF replaced')
+        exhibits[0].save()
+        replaced_name = exhibits[0].introductory_page.name
+        self.assertNotEqual(replaced_name, shared_name)
+        self.assertFalse(storage.exists(shared_name))
+        self.assertTrue(storage.exists(other_name))
+
+        # Once no exhibit refers to them, files are collected
+        exhibits[1].delete()
+        self.assertFalse(storage.exists(other_name))
+        self.assertFalse(storage.exists(os.path.dirname(shared_name)))
+
+        # Files stored recently are kept, in case their exhibit is still being saved
+        exhibits[0].delete()
+        self.assertTrue(storage.exists(replaced_name))
+        self.assertEqual(Exhibit.collect_files([replaced_name], force=True), [replaced_name])
+        self.assertFalse(storage.exists(replaced_name))
+
+    @override_settings(EXHIBIT_FILES_COLLECT_INTERVAL=3600)
+    def test_collect_unreferenced(self):
+        participant = create_participant(1, appointments=False, travel_details=False)
+        exhibit = Exhibit.objects.create(participant=participant, title='Exhibit', short_description='Description', exhibit_class='TP', frames=5,
+                                         introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+        storage = exhibit.introductory_page.storage
+        # Uploaded with forms that were never saved
+        names = [storage.save('exhibit/unsaved.pdf', ContentFile(b'%PDF unsaved')),
+                 storage.save('exhibit/recent.pdf', ContentFile(b'%PDF recent'))]
+        self.backdate(storage, exhibit.introductory_page.name)
+        self.backdate(storage, names[0])
+
+        call_command('export_worker', once=True, stdout=io.StringIO())
+        self.assertFalse(storage.exists(names[0]))
+        self.assertTrue(storage.exists(names[1]))
+        self.assertTrue(storage.exists(exhibit.introductory_page.name))
+
+
+@override_settings(MEDIA_ROOT=TEST_MEDIA_ROOT, CATALOGUE_DEBOUNCE=3600, CATALOGUE_MAX_DELAY=3600)
+class CatalogueTests(TestCase):
+    def setUp(self):
+        # Publishing depends on the state left in the directory, so start from an empty one
+        directory = tempfile.mkdtemp(prefix='notos-catalogue-')
+        self.addCleanup(shutil.rmtree, directory, ignore_errors=True)
+        catalogue_settings = self.settings(CATALOGUE_ROOT=directory)
+        catalogue_settings.enable()
+        self.addCleanup(catalogue_settings.disable)
+
+    def read(self, name):
+        with open(os.path.join(settings.CATALOGUE_ROOT, name), encoding='utf-8') as stream:
+            return stream.read()
+
+    def test_publish(self):
+        participant = create_participant(1, appointments=False, travel_details=False)
+        exhibit = Exhibit.objects.create(participant=participant, title='First title', short_description='Description', exhibit_class='C1', frames=5,
+                                         introductory_page=SimpleUploadedFile('intro.pdf', b'%PDF'))
+
+        # Published right away the first time, then only once changes settle
+        self.assertTrue(publish_changed_catalogue())
+        for name in CATALOGUE_FILES:
+            self.assertIn('First title', self.read(name))
+        self.assertFalse(publish_changed_catalogue())
+
+        exhibit.title = 'Second title'
+        exhibit.save()
+        self.assertFalse(publish_changed_catalogue())
+        with self.settings(CATALOGUE_DEBOUNCE=0):
+            self.assertTrue(publish_changed_catalogue())
+            self.assertIn('Second title', self.read('exhibits-class.html'))
+            self.assertFalse(publish_changed_catalogue())
@@ -16,7 +16,6 @@
 
 from django.urls import path
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib.auth import views as auth_views
 
 from . import views
@@ -32,6 +31,9 @@ urlpatterns = [
     path('export_raw', views.export_raw, name='export_raw'),
     path('export_report', views.export_report, name='export_report'),
     path('export_exhibits', views.export_exhibits, name='export_exhibits'),
+    path('export_jury_media', views.export_jury_media, name='export_jury_media'),
+    path('export_jobs', views.export_jobs, name='export_jobs'),
+    path('export_jobs/<int:job_id>', views.export_job_download, name='export_job_download'),
 
     path('signup', views.signup, name='signup'),
     path('activate/<slug:uidb64>/<slug:token>', views.activate, name='activate'),
@@ -42,5 +44,7 @@ urlpatterns = [
     path('logout', views.logout, {'next': settings.LOGOUT_REDIRECT_URL}, name='logout'),
 ]
 
-if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+# Uploads are only served to their owners and staff (see MEDIA_SENDFILE)
+urlpatterns += [
+    path('%s<path:path>' % settings.MEDIA_URL.lstrip('/'), views.media, name='media'),
+]
@@ -14,31 +14,41 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
 
-import io
-import zipfile
-import xlsxwriter
+import hashlib
 
-from django.shortcuts import render, redirect, reverse, HttpResponse
+from django.shortcuts import render, redirect, reverse, get_object_or_404, HttpResponse
+from django.http import StreamingHttpResponse, HttpResponseBadRequest, FileResponse, Http404
 from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch
 from django.forms import inlineformset_factory
 from django.template.loader import render_to_string
-from django.core.mail import send_mail
 from django.contrib.auth import login, logout as auth_logout, BACKEND_SESSION_KEY, update_session_auth_hash
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.models import User
 from django.contrib.auth.tokens import default_token_generator
 from django.contrib.admin.views.decorators import staff_member_required
+from django.views.decorators.http import condition
+from django.views.decorators.cache import cache_control
 from django.contrib import messages
 from django.utils.encoding import force_bytes, force_text
 from django.utils.http import urlsafe_base64_encode, urlsafe_base64_decode
-from django_countries import countries
+from django.utils.dateparse import parse_datetime
+from django.utils.safestring import mark_safe
+from django.utils import timezone
 from textwrap import shorten
-from datetime import datetime
-from collections import OrderedDict
 
-from .models import Participant, Federation, Appointments, Exhibit, ExhibitParticipation, TravelDetails
+from .models import Participant, Appointments, Exhibit, ExhibitParticipation, TravelDetails, ExportJob
 from .forms import ParticipantForm, AppointmentsForm, ExhibitForm, ExhibitParticipationForm, TravelDetailsForm, SignUpForm, ChangePasswordForm, ForgotPasswordForm, ResetPasswordForm
 from .tokens import account_activation_token
+from .snapshot import export_snapshot, snapshot_stream
+from .media import media_name, media_allowed, media_response
+from .mail import queue_mail, queue_exhibit_registration, commissioner_recipients
+from .export import export_name, stream_csv_zip, raw_csv_members, write_xlsx, xlsx_response, write_raw_xlsx, write_report_xlsx, render_exhibits, raw_cache, report_cache, exhibits_cache, jury_media_members, stream_media_zip
+
+
+# Rendered printouts are kept for this long (in seconds)
+PRINTOUT_CACHE_TIMEOUT = 24 * 60 * 60
 
 
 @login_required
@@ -46,10 +56,7 @@ def register(request, step=None, exhibit_id=None):
     if step == 'exhibit' and request.method == 'POST' and settings.ENTRY_FORMS_DISABLED_MESSAGE:
         return redirect('register', step='personal')
 
-    try:
-        participant = Participant.objects.get(user=request.user)
-    except Participant.DoesNotExist:
-        participant = None
+    participant = Participant.registration_state(request.user)
 
     if step == 'personal':
         form_title = 'Personal'
@@ -92,7 +99,8 @@ def register(request, step=None, exhibit_id=None):
                 participant.save()
                 return redirect('register', step=step)
         elif step == 'appointments':
-            form = AppointmentsForm(request.POST, instance=participant.appointments.first())
+            appointments = Appointments.objects.get(pk=participant.first_appointments_id) if participant.first_appointments_id else None
+            form = AppointmentsForm(request.POST, instance=appointments)
             form.helper.form_action = reverse('register', kwargs={'step': step})
             formset = None
             if form.is_valid():
@@ -113,7 +121,7 @@ def register(request, step=None, exhibit_id=None):
                     content = render_to_string('registrations/email.html', {'title': title,
                                                                             'message': message,
                                                                             'sections': sections})
-                    send_mail('%s - %s' % (settings.EXHIBITION_NAME, title), '%s (in HTML format)' % title, settings.EMAIL_HOST_USER, recipients, html_message=content)
+                    queue_mail('%s - %s' % (settings.EXHIBITION_NAME, title), '%s (in HTML format)' % title, settings.EMAIL_HOST_USER, recipients, html_message=content)
 
                 return redirect('register', step=step)
         elif step == 'exhibit':
@@ -131,43 +139,15 @@ def register(request, step=None, exhibit_id=None):
                 exhibit.save()
                 formset.save()
 
-                email_to = None
-                commissioner_appointments = Appointments.objects.filter(commissioner=True, federation__country_code=participant.country.code).first()
-                if commissioner_appointments:
-                    email_to = [commissioner_appointments.participant.email]
-                else:
-                    federation = Federation.objects.filter(country_code=participant.country.code).first()
-                    if federation:
-                        if federation.commissioner_email:
-                            email_to = [federation.commissioner_email]
-                        else:
-                            email_to = federation.email_list()
-                if not email_to and settings.NO_COMMISSIONER_EMAIL:
-                    email_to = [settings.NO_COMMISSIONER_EMAIL]
-
+                email_to = commissioner_recipients(participant.country.code)
                 if email_to:
-                    title = 'Exhibit Registration'
                     recipients = ([] if settings.EMAIL_ONLY_ADDITIONAL_RECIPIENTS else email_to) + settings.EMAIL_ADDITIONAL_RECIPIENTS
-                    message = 'Dear Commissioner,<br />This is the entry form data we received from the prospective exhibitor of your country.<br />(a) In case there are errors, please get in contact with the exhibitor and advise him/her to correct the errors and re-submit.<br />(b) If, however, you disapprove of the application, please '
-                    if settings.GENERAL_COMMISSIONER_EMAIL:
-                        message += 'email the General Commissioner at <a class="text-dark" href="mailto:%s">%s</a>.' % (settings.GENERAL_COMMISSIONER_EMAIL, settings.GENERAL_COMMISSIONER_EMAIL)
-                    else:
-                        message += 'email us at <a class="text-dark" href="mailto:%s">%s</a>.' % (settings.EXHIBITION_EMAIL, settings.EXHIBITION_EMAIL)
-                    sections = [{'title': 'Personal',
-                                 'fields': participant.printout(),
-                                 'subsections': []},
-                                {'title': 'Entry',
-                                 'fields': exhibit.printout(),
-                                 'subsections': [{'title': 'Previous participation #%d' % (j + 1),
-                                                  'fields': participation.printout()} for j, participation in enumerate(exhibit.participations.all())]}]
-                    content = render_to_string('registrations/email.html', {'title': title,
-                                                                            'message': message,
-                                                                            'sections': sections})
-                    send_mail('%s - %s' % (settings.EXHIBITION_NAME, title), '%s (in HTML format)' % title, settings.EMAIL_HOST_USER, recipients, html_message=content)
+                    queue_exhibit_registration(recipients, exhibit)
 
                 return redirect('edit_exhibit', exhibit_id=exhibit.id)
         elif step == 'travel':
-            form = TravelDetailsForm(request.POST, instance=participant.travel_details.first())
+            travel_details = TravelDetails.objects.get(pk=participant.first_travel_details_id) if participant.first_travel_details_id else None
+            form = TravelDetailsForm(request.POST, instance=travel_details)
             form.helper.form_action = reverse('register', kwargs={'step': step})
             formset = None
             if form.is_valid():
@@ -186,7 +166,7 @@ def register(request, step=None, exhibit_id=None):
             form.helper.form_action = reverse('register', kwargs={'step': step})
             formset = None
         elif step == 'appointments':
-            appointments = participant.appointments.first() if participant else None
+            appointments = Appointments.objects.get(pk=participant.first_appointments_id) if (participant and participant.first_appointments_id) else None
             form = AppointmentsForm(instance=appointments)
             form.helper.form_action = reverse('register', kwargs={'step': step})
             formset = None
@@ -199,7 +179,7 @@ def register(request, step=None, exhibit_id=None):
             ExhibitParticipationFormSet = inlineformset_factory(Exhibit, ExhibitParticipation, form=ExhibitParticipationForm, extra=1, max_num=6)
             formset = ExhibitParticipationFormSet(instance=exhibit, prefix='nested')
         elif step == 'travel':
-            travel_details = participant.travel_details.first() if participant else None
+            travel_details = TravelDetails.objects.get(pk=participant.first_travel_details_id) if (participant and participant.first_travel_details_id) else None
             form = TravelDetailsForm(instance=travel_details)
             form.helper.form_action = reverse('register', kwargs={'step': step})
             formset = None
@@ -221,17 +201,17 @@ def register(request, step=None, exhibit_id=None):
               'url': reverse('register', kwargs={'step': 'personal'})},
              {'title': 'Appointments',
               'description': 'Commissioner/Jury data',
-              'done': participant and participant.appointments.count(),
+              'done': bool(participant and participant.first_appointments_id),
               'current': step == 'appointments',
               'url': reverse('register', kwargs={'step': 'appointments'})},
              {'title': 'Entry forms',
               'description': 'Participating exhibits',
-              'done': participant and participant.exhibits.count(),
+              'done': bool(participant and participant.has_exhibits),
               'current': step == 'exhibit',
               'url': reverse('register', kwargs={'step': 'exhibit'})},
              {'title': 'Travel details',
               'description': 'Flights, accommodation, etc.',
-              'done': participant and participant.travel_details.count(),
+              'done': bool(participant and participant.first_travel_details_id),
               'current': step == 'travel',
               'url': reverse('register', kwargs={'step': 'travel'})}]
     can_change_password = local_account
@@ -257,190 +237,183 @@ def remove_exhibit(request, exhibit_id=None):
 
     return redirect('register', step='exhibit')
 
-@login_required
-def printout(request):
-    try:
-        participant = Participant.objects.get(user=request.user)
-    except Participant.DoesNotExist:
-        return redirect('register', step='personal')
-
+def page_etag(state, *variant):
+    # ETag of a page, from the aggregate state of the rows it is made of. There is no
+    # Last-Modified: removing rows changes the counts in the state, but not the newest change.
+    return hashlib.sha1(repr((sorted(state.items()),) + variant).encode('utf-8')).hexdigest()
+
+def printout_etag(request):
+    # Computed once per request, for the condition check and the page cache
+    if not hasattr(request, 'printout_etag'):
+        state = Participant.printout_state(request.user)
+        request.printout_etag = page_etag(state) if state['id'] else None
+    return request.printout_etag
+
+def exhibits_etag(request):
+    return page_etag(Exhibit.listing_state(), request.get_full_path(), request.build_absolute_uri(settings.MEDIA_URL))
+
+def printout_participant(user):
+    # Everything in the printout in a fixed number of queries, related rows in pk order
+    # (so that the first appointments/travel details are the ones shown)
+    exhibits = Exhibit.objects.order_by('pk').prefetch_related(Prefetch('participations', queryset=ExhibitParticipation.objects.order_by('pk')))
+    return Participant.objects.prefetch_related(Prefetch('appointments', queryset=Appointments.objects.select_related('federation').order_by('pk')),
+                                                Prefetch('exhibits', queryset=exhibits),
+                                                Prefetch('travel_details', queryset=TravelDetails.objects.order_by('pk'))).get(user=user)
+
+def printout_sections(participant):
     sections = []
     sections.append({'title': 'Personal',
                      'fields': participant.printout(),
                      'subsections': []})
-    if participant.appointments.count():
+    appointments = participant.appointments.all()
+    if appointments:
         sections.append({'title': 'Appointments',
-                         'fields': participant.appointments.first().printout(),
+                         'fields': appointments[0].printout(),
                          'subsections': []})
     for i, exhibit in enumerate(participant.exhibits.all()):
         sections.append({'title': 'Entry #%d' % (i + 1),
                          'fields': exhibit.printout(),
                          'subsections': [{'title': 'Previous participation #%d' % (j + 1),
                                           'fields': participation.printout()} for j, participation in enumerate(exhibit.participations.all())]})
-    if participant.travel_details.count():
+    travel_details = participant.travel_details.all()
+    if travel_details:
         sections.append({'title': 'Travel details',
-                         'fields': participant.travel_details.first().printout(),
+                         'fields': travel_details[0].printout(),
                          'subsections': []})
-    return render(request, 'registrations/print.html', {'sections': sections})
+    return sections
+
+# Pages that did not change since the browser last got them are answered with 304 Not Modified
+@login_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=printout_etag)
+def printout(request):
+    etag = printout_etag(request)
+    if etag is None:
+        return redirect('register', step='personal')
+
+    # The validator covers the registration data, so it is rendered once per change,
+    # while the rest of the page (with the time it was generated) is rendered every time
+    cache_key = 'printout-%s' % etag
+    sections_html = cache.get(cache_key)
+    if sections_html is None:
+        try:
+            participant = printout_participant(request.user)
+        except Participant.DoesNotExist:
+            return redirect('register', step='personal')
+        sections_html = render_to_string('registrations/print_sections.html', {'sections': printout_sections(participant)}, request)
+        cache.set(cache_key, sections_html, PRINTOUT_CACHE_TIMEOUT)
+    return render(request, 'registrations/print.html', {'sections_html': mark_safe(sections_html)})
+
+@login_required
+def media(request, path):
+    # Files of others are reported missing, so that their names cannot be probed
+    name = media_name(path)
+    if name is None or not media_allowed(request.user, name):
+        raise Http404
+    response = media_response(name)
+    if response is None:
+        raise Http404
+    return response
 
 @staff_member_required
 def export_raw(request):
     export_type = request.GET.get('type', 'csv')
-    export_name = '%s-export-%s' % (settings.EXHIBITION_NAME.replace(' ', '-'), datetime.now().strftime('%Y%m%d%H%M%S'))
-
-    if export_type == 'csv':
-        zip_stream = io.BytesIO()
-        with zipfile.ZipFile(zip_stream, mode="w", compression=zipfile.ZIP_DEFLATED) as zip_file:
-            zip_file.writestr('%s/registrants.csv' % export_name, Participant.export_to_csv())
-            zip_file.writestr('%s/exhibits.csv' % export_name, Exhibit.export_to_csv())
-            zip_file.writestr('%s/exhibit_participations.csv' % export_name, ExhibitParticipation.export_to_csv())
-            zip_file.writestr('%s/federations.csv' % export_name, Federation.export_to_csv())
-            zip_file.writestr('%s/countries.csv' % export_name, Participant.export_countries_to_csv())
-            zip_file.writestr('%s/titles.csv' % export_name, Participant.export_choices_to_csv(Participant.TITLE_CHOICES))
-            zip_file.writestr('%s/languages.csv' % export_name, Participant.export_choices_to_csv(Participant.LANGUAGE_CHOICES))
-            zip_file.writestr('%s/accredited_jurors.csv' % export_name, Appointments.export_choices_to_csv(Appointments.ACCREDITED_JUROR_CHOICES))
-            zip_file.writestr('%s/exhibit_classes.csv' % export_name, Exhibit.export_choices_to_csv(Exhibit.EXHIBIT_CLASS_CHOICES))
-            zip_file.writestr('%s/exhibition_levels.csv' % export_name, ExhibitParticipation.export_choices_to_csv(ExhibitParticipation.EXHIBITION_LEVEL_CHOICES))
-            zip_file.writestr('%s/medals.csv' % export_name, ExhibitParticipation.export_choices_to_csv(ExhibitParticipation.MEDAL_CHOICES))
-
-        response = HttpResponse(zip_stream.getvalue(), content_type='application/zip')
-        response['Content-Disposition'] = 'attachment; filename="%s.zip"' % export_name
-        return response
+    name = export_name('export')
+
+    # Incremental exports include only rows changed after since (as returned
+    # in the X-Export-Cursor header of a previous export), plus deleted exhibits
+    since = request.GET.get('since', '')
+    if since:
+        try:
+            since = parse_datetime(since)
+        except ValueError:
+            since = None
+        if since is None:
+            return HttpResponseBadRequest('Invalid since timestamp')
+        if timezone.is_naive(since):
+            since = timezone.make_aware(since)
     else:
-        xlsx_stream = io.BytesIO()
-        xlsx_options = {'strings_to_numbers': False,
-                        'strings_to_formulas': False,
-                        'strings_to_urls': False}
-        with xlsxwriter.Workbook(xlsx_stream, xlsx_options) as workbook:
-            Participant.export_to_xlsx(workbook, 'registrants')
-            Exhibit.export_to_xlsx(workbook, 'exhibits')
-            ExhibitParticipation.export_to_xlsx(workbook, 'exhibit_participations')
-            Federation.export_to_xlsx(workbook, 'federations')
-            Participant.export_countries_to_xlsx(workbook, 'countries')
-            Participant.export_choices_to_xlsx(workbook, 'titles', Participant.TITLE_CHOICES)
-            Participant.export_choices_to_xlsx(workbook, 'languages', Participant.LANGUAGE_CHOICES)
-            Appointments.export_choices_to_xlsx(workbook, 'accredited_jurors', Appointments.ACCREDITED_JUROR_CHOICES)
-            Exhibit.export_choices_to_xlsx(workbook, 'exhibit_classes', Exhibit.EXHIBIT_CLASS_CHOICES)
-            ExhibitParticipation.export_choices_to_xlsx(workbook, 'exhibition_levels', ExhibitParticipation.EXHIBITION_LEVEL_CHOICES)
-            ExhibitParticipation.export_choices_to_xlsx(workbook, 'medals', ExhibitParticipation.MEDAL_CHOICES)
-
-        response = HttpResponse(xlsx_stream.getvalue(), content_type='application/xlsx')
-        response['Content-Disposition'] = 'attachment; filename="%s.xlsx"' % export_name
-        return response
+        since = None
+    # With a snapshot, the next delta starts from when it was taken
+    with export_snapshot() as taken_at:
+        cursor = (taken_at or timezone.now()).strftime('%Y-%m-%dT%H:%M:%S.%fZ')
+
+        if since is not None:
+            if export_type == 'csv':
+                response = StreamingHttpResponse(snapshot_stream(stream_csv_zip(raw_csv_members(since))), content_type='application/zip')
+                response['Content-Disposition'] = 'attachment; filename="%s.zip"' % name
+            else:
+                response = xlsx_response(lambda workbook: write_raw_xlsx(workbook, since), '%s.xlsx' % name)
+            response['X-Export-Cursor'] = cursor
+            return response
+
+        cache = raw_cache(export_type)
+        if export_type == 'csv':
+            if cache.exists():
+                response = FileResponse(cache.open(), as_attachment=True, filename='%s.zip' % name, content_type='application/zip')
+            else:
+                response = StreamingHttpResponse(snapshot_stream(cache.tee(stream_csv_zip(raw_csv_members()))), content_type='application/zip')
+                response['Content-Disposition'] = 'attachment; filename="%s.zip"' % name
+        else:
+            if not cache.exists():
+                cache.write(lambda stream: write_xlsx(stream, write_raw_xlsx))
+            response = FileResponse(cache.open(), as_attachment=True, filename='%s.xlsx' % name, content_type='application/xlsx')
+    response['X-Export-Cursor'] = cursor
+    return response
 
 @staff_member_required
 def export_report(request):
     report_type = request.GET.get('type', '')
-    report_name = '%s-report-%s' % (settings.EXHIBITION_NAME.replace(' ', '-'), datetime.now().strftime('%Y%m%d%H%M%S'))
-
-    def write_entries(worksheet, entries):
-        next_column = 0
-        for section in entries[0].keys():
-            row = 0
-            column = next_column
-            next_column = 0
-            titles_written = False
-            for entry in [e[section] for e in entries]:
-                row += 1
-                if not entry:
-                    continue
-                if not titles_written:
-                    worksheet.write_row(0, column, entry.keys())
-                    next_column = column + len(entry)
-                    titles_written = True
-                worksheet.write_row(row, column, ['\n'.join(str(v).splitlines()) for v in entry.values()])
-
-    xlsx_stream = io.BytesIO()
-    xlsx_options = {'strings_to_numbers': False,
-                    'strings_to_formulas': False,
-                    'strings_to_urls': False}
-    with xlsxwriter.Workbook(xlsx_stream, xlsx_options) as workbook:
-        if report_type != 'inventory':
-            worksheet = workbook.add_worksheet('Registrants')
-            entries = []
-            for participant in Participant.objects.all():
-                entries.append({'id': {'ID': participant.id},
-                                'participant': participant.printout(all_fields=True),
-                                'appointments': participant.appointments.first().printout(all_fields=True) if participant.appointments.count() else None,
-                                'travel_details': participant.travel_details.first().printout(all_fields=True) if participant.travel_details.count() else None})
-            write_entries(worksheet, entries)
-
-        worksheet = workbook.add_worksheet('Exhibits')
-        entries = []
-        if report_type != 'inventory':
-            all_exhibits = Exhibit.objects.all()
-        else:
-            all_exhibits = Exhibit.objects.filter(rejected=False).exclude(exhibit_class__startswith='L')
-        for exhibit in all_exhibits:
-            entries.append({'id': {'ID': exhibit.id},
-                            'exhibit': exhibit.printout(all_fields=True),
-                            'participant': exhibit.participant.printout(all_fields=True)})
-        write_entries(worksheet, entries)
-
-    response = HttpResponse(xlsx_stream.getvalue(), content_type='application/xlsx')
-    response['Content-Disposition'] = 'attachment; filename="%s.xlsx"' % report_name
-    return response
+
+    with export_snapshot():
+        cache = report_cache(report_type)
+        if not cache.exists():
+            cache.write(lambda stream: write_xlsx(stream, lambda workbook: write_report_xlsx(workbook, report_type)))
+    return FileResponse(cache.open(), as_attachment=True, filename='%s.xlsx' % export_name('report'), content_type='application/xlsx')
 
 @staff_member_required
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=exhibits_etag)
 def export_exhibits(request):
     export_sort = request.GET.get('sort', 'class')
     extras = request.GET.get('extras', '')
     extras = int(extras) if extras.isdigit() else 0
 
-    # XXX Create some new model for these...
-    JURY_GROUP_NAMES = {'C1': {1: 'Europe North, West, Rest of the World',
-                               2: 'Europe South, East, Mediterranean Sea'},
-                        'C2': {1: 'Europe North, West, Rest of the World',
-                               2: 'Europe South, East, Mediterranean Sea'},
-                        'C7': {1: 'History, Sports',
-                               2: 'Culture, Science, Nature, Transportation'}}
-
-    if export_sort == 'class':
-        exhibit_sections = OrderedDict({'non-competitive': {'title': 'Non-Competitive Classes',
-                                                            'classes': []},
-                                        'competitive': {'title': 'Competitive Classes',
-                                                        'classes': []}})
-        for exhibit_class, exhibit_class_title in Exhibit.EXHIBIT_CLASS_CHOICES:
-            section = 'non-competitive' if exhibit_class_title.startswith('A') else 'competitive'
-            exhibits = Exhibit.objects.filter(exhibit_class=exhibit_class, rejected=False).order_by('start_frame', 'participant__surname')
-            if len(exhibits) == 0:
-                continue
-            if extras:
-                jury_groups = set([exhibit.jury_group for exhibit in exhibits])
-                if len(jury_groups) > 1:
-                    for jury_group in sorted([(j if j else 0) for j in jury_groups]):
-                        if jury_group:
-                            try:
-                                jury_group_title_suffix = ' (%s)' % JURY_GROUP_NAMES[exhibit_class][jury_group]
-                            except KeyError:
-                                jury_group_title_suffix = ' (jury group %d)' % jury_group
-                        else:
-                            jury_group_title_suffix = ' (empty jury group)'
-                        exhibit_sections[section]['classes'].append({'title': exhibit_class_title + jury_group_title_suffix,
-                                                                     'exhibits': exhibits.filter(jury_group=jury_group if jury_group else None)})
-                    continue
-            exhibit_sections[section]['classes'].append({'title': exhibit_class_title,
-                                                         'exhibits': exhibits})
-    else:
-        exhibit_countries = set()
-        for exhibit in Exhibit.objects.all():
-            exhibit_countries.add(exhibit.participant.country.name)
-        exhibit_countries = sorted(list(exhibit_countries))
-
-        exhibit_sections = OrderedDict()
-        for country in exhibit_countries:
-            exhibit_classes = []
-            for exhibit_class, exhibit_class_title in Exhibit.EXHIBIT_CLASS_CHOICES:
-                exhibits = Exhibit.objects.filter(exhibit_class=exhibit_class, participant__country=countries.by_name(country), rejected=False).order_by('participant__surname')
-                if len(exhibits) == 0:
-                    continue
-                exhibit_classes.append({'title': exhibit_class_title,
-                                        'exhibits': exhibits})
-            exhibit_sections[country] = {'title': country,
-                                         'classes': exhibit_classes}
+    media_url = request.build_absolute_uri(settings.MEDIA_URL)
 
-    return render(request, 'registrations/exhibits.html', {'exhibit_sections': exhibit_sections,
-                                                           'extras': extras})
+    cache = exhibits_cache(export_sort, extras, media_url)
+    if not cache.exists():
+        cache.write(lambda stream: stream.write(render_exhibits(export_sort, extras, media_url).encode('utf-8')))
+    with cache.open() as stream:
+        return HttpResponse(stream.read())
+
+@staff_member_required
+def export_jury_media(request):
+    # Files are listed up front, then streamed one after the other
+    response = StreamingHttpResponse(stream_media_zip(jury_media_members()), content_type='application/zip')
+    response['Content-Disposition'] = 'attachment; filename="%s.zip"' % export_name('jury-media')
+    return response
+
+@staff_member_required
+def export_jobs(request):
+    if request.method == 'POST':
+        kind = request.POST.get('kind', '')
+        if kind in dict(ExportJob.KIND_CHOICES):
+            ExportJob.objects.create(kind=kind,
+                                     requested_by=request.user,
+                                     media_url=request.build_absolute_uri(settings.MEDIA_URL))
+        return redirect('export_jobs')
+
+    jobs = ExportJob.objects.select_related('requested_by').order_by('-created_at')[:50]
+    refresh = any(job.status in ('PENDING', 'RUNNING') for job in jobs)
+    return render(request, 'registrations/export_jobs.html', {'jobs': jobs,
+                                                              'kinds': ExportJob.KIND_CHOICES,
+                                                              'refresh': refresh})
+
+@staff_member_required
+def export_job_download(request, job_id):
+    job = get_object_or_404(ExportJob, id=job_id, status='DONE')
+    return FileResponse(job.artifact.open('rb'), as_attachment=True, filename=job.artifact.name)
 
 def signup(request):
     if request.method == 'POST':
@@ -459,7 +432,7 @@ def signup(request):
             content = render_to_string('registrations/email.html', {'title': title,
                                                                     'message': message,
                                                                     'sections': None})
-            send_mail('%s - %s' % (settings.EXHIBITION_NAME, title), '%s (in HTML format)' % title, settings.EMAIL_HOST_USER, [user.email], html_message=content)
+            queue_mail('%s - %s' % (settings.EXHIBITION_NAME, title), '%s (in HTML format)' % title, settings.EMAIL_HOST_USER, [user.email], html_message=content)
 
             message = 'Your account has been created, but in order to login you have to confirm your email address.<br />We have sent you an email with instructions on how to complete the sign up process.'
             return render(request, 'registrations/account.html', {'message': message,
@@ -509,7 +482,7 @@ def forgot_password(request):
                 content = render_to_string('registrations/email.html', {'title': title,
                                                                         'message': message,
                                                                         'sections': None})
-                send_mail('%s - %s' % (settings.EXHIBITION_NAME, title), '%s (in HTML format)' % title, settings.EMAIL_HOST_USER, [user.email], html_message=content)
+                queue_mail('%s - %s' % (settings.EXHIBITION_NAME, title), '%s (in HTML format)' % title, settings.EMAIL_HOST_USER, [user.email], html_message=content)
 
             message = 'If the email belongs to a valid local account, we will send you instructions <br />on how to proceed with resetting the password.'
             return render(request, 'registrations/account.html', {'message': message,
@@ -0,0 +1,8 @@
+#!/bin/bash
+set -e
+APPDIR=/srv/notos
+cd $APPDIR
+source $APPDIR/venv/bin/activate
+export DJANGO_SETTINGS_MODULE=exhibition.settings.production
+exec python manage.py export_worker
+exit 0